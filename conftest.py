@@ -0,0 +1,24 @@
+"""
+Shared pytest fixtures for tingly-agent-shell tests
+"""
+
+import pytest
+import pytest_asyncio
+
+from tingly_agent_shell import Shell, ShellConfig, ShellPool, drain_reapers
+
+
+@pytest.fixture(scope="session")
+def shared_shell():
+    """One persistent shell for the whole session; tests fork it for isolation"""
+    shell = Shell(config=ShellConfig(persistent=True))
+    yield shell
+    shell.close()
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def reap_closed_shells():
+    """Wait for shells closed by a test to exit before its event loop ends"""
+    yield
+    await drain_reapers()
+    await ShellPool.get().close()
@@ -4,118 +4,124 @@ Advanced examples demonstrating environment variable tracking and setup_rc
 """
 
 import asyncio
+import io
+import traceback
 
-from tingly_agent_shell import create_shell
+from tingly_agent_shell import ShellConfig, create_shell
 
 
-async def example_env_tracking():
+async def example_env_tracking(base, out):
     """Example: Environment variable tracking from export commands"""
-    print("=== Example 1: Environment Variable Tracking ===")
+    print("=== Example 1: Environment Variable Tracking ===", file=out)
 
-    shell = await create_shell()
+    shell = base.fork()
 
     # Set a variable using export
-    print("1. Setting MY_VAR via export...")
+    print("1. Setting MY_VAR via export...", file=out)
     await shell.execute("export MY_VAR='hello_world'")
-    print(f"   Tracked value: {shell.getenv('MY_VAR')}")
+    print(f"   Tracked value: {shell.getenv('MY_VAR')}", file=out)
 
     # Update the variable
-    print("\n2. Updating MY_VAR...")
+    print("\n2. Updating MY_VAR...", file=out)
     await shell.execute("export MY_VAR='updated_value'")
-    print(f"   Tracked value: {shell.getenv('MY_VAR')}")
+    print(f"   Tracked value: {shell.getenv('MY_VAR')}", file=out)
 
     # Set PATH with variable expansion
-    print("\n3. Modifying PATH...")
+    print("\n3. Modifying PATH...", file=out)
     await shell.execute("export PATH='/custom/bin:$PATH'")
     path = shell.getenv("PATH")
-    print(f"   PATH starts with: {path[:50]}...")
+    print(f"   PATH starts with: {path[:50]}...", file=out)
 
     shell.close()
-    print()
+    print(file=out)
 
 
-async def example_setup_rc_multiple():
+async def example_setup_rc_multiple(base, out):
     """Example: Multiple setup commands with variable expansion"""
-    print("=== Example 2: Multiple Setup Commands ===")
-
-    # Create shell with multiple setup commands
-    shell = await create_shell(
-        pre_scripts=[
-            "export BASE_DIR='/tmp/myapp'",
-            "export CONFIG_FILE='$BASE_DIR/config.yaml'",
-            "export DATA_DIR='$BASE_DIR/data'",
-            "export LOG_FILE='$DATA_DIR/app.log'",
-        ]
+    print("=== Example 2: Multiple Setup Commands ===", file=out)
+
+    # Fork shell with multiple setup commands
+    shell = base.fork(
+        ShellConfig(
+            pre_scripts=[
+                "export BASE_DIR='/tmp/myapp'",
+                "export CONFIG_FILE='$BASE_DIR/config.yaml'",
+                "export DATA_DIR='$BASE_DIR/data'",
+                "export LOG_FILE='$DATA_DIR/app.log'",
+            ]
+        )
     )
 
-    print("Setup variables from config:")
-    print(f"  BASE_DIR: {shell.getenv('BASE_DIR')}")
-    print(f"  CONFIG_FILE: {shell.getenv('CONFIG_FILE')}")
-    print(f"  DATA_DIR: {shell.getenv('DATA_DIR')}")
-    print(f"  LOG_FILE: {shell.getenv('LOG_FILE')}")
+    print("Setup variables from config:", file=out)
+    print(f"  BASE_DIR: {shell.getenv('BASE_DIR')}", file=out)
+    print(f"  CONFIG_FILE: {shell.getenv('CONFIG_FILE')}", file=out)
+    print(f"  DATA_DIR: {shell.getenv('DATA_DIR')}", file=out)
+    print(f"  LOG_FILE: {shell.getenv('LOG_FILE')}", file=out)
 
     shell.close()
-    print()
+    print(file=out)
 
 
-async def example_fork_with_env_changes():
+async def example_fork_with_env_changes(base, out):
     """Example: Forking preserves environment changes"""
-    print("=== Example 3: Fork with Environment Changes ===")
+    print("=== Example 3: Fork with Environment Changes ===", file=out)
 
-    parent = await create_shell()
+    parent = base.fork()
 
     # Set up environment in parent
-    print("1. Parent setting up environment...")
+    print("1. Parent setting up environment...", file=out)
     await parent.execute("export PARENT_VAR='from_parent'")
     await parent.execute("export SHARED_RESOURCE='/shared/data'")
 
     # Fork child
-    print("\n2. Creating child shell...")
+    print("\n2. Creating child shell...", file=out)
     child = parent.fork()
 
     # Check child has inherited variables
-    print(f"   Child has PARENT_VAR: {child.getenv('PARENT_VAR')}")
-    print(f"   Child has SHARED_RESOURCE: {child.getenv('SHARED_RESOURCE')}")
+    print(f"   Child has PARENT_VAR: {child.getenv('PARENT_VAR')}", file=out)
+    print(f"   Child has SHARED_RESOURCE: {child.getenv('SHARED_RESOURCE')}", file=out)
 
     # Modify child's environment
-    print("\n3. Child modifying its environment...")
+    print("\n3. Child modifying its environment...", file=out)
     await child.execute("export CHILD_VAR='only_in_child'")
     await child.execute("export SHARED_RESOURCE='/child/override'")
 
     # Verify isolation
-    print(f"\n4. Verifying isolation:")
-    print(f"   Parent SHARED_RESOURCE: {parent.getenv('SHARED_RESOURCE')}")
-    print(f"   Child SHARED_RESOURCE: {child.getenv('SHARED_RESOURCE')}")
-    print(f"   Parent CHILD_VAR: {parent.getenv('CHILD_VAR')}")
-    print(f"   Child CHILD_VAR: {child.getenv('CHILD_VAR')}")
+    print(f"\n4. Verifying isolation:", file=out)
+    print(f"   Parent SHARED_RESOURCE: {parent.getenv('SHARED_RESOURCE')}", file=out)
+    print(f"   Child SHARED_RESOURCE: {child.getenv('SHARED_RESOURCE')}", file=out)
+    print(f"   Parent CHILD_VAR: {parent.getenv('CHILD_VAR')}", file=out)
+    print(f"   Child CHILD_VAR: {child.getenv('CHILD_VAR')}", file=out)
 
     parent.close()
     child.close()
-    print()
+    print(file=out)
 
 
-async def example_complex_setup():
+async def example_complex_setup(base, out):
     """Example: Complex setup with conditional logic"""
-    print("=== Example 4: Complex Setup Scenario ===")
+    print("=== Example 4: Complex Setup Scenario ===", file=out)
 
     # Simulate a development environment setup
-    shell = await create_shell(
-        pre_scripts=[
-            "export ENV='development'",
-            "export DEBUG='true'",
-            "export LOG_LEVEL='debug'",
-            "export DB_HOST='localhost'",
-            "export DB_PORT='5432'",
-            "export DB_NAME='myapp_dev'",
-        ]
+    shell = base.fork(
+        ShellConfig(
+            pre_scripts=[
+                "export ENV='development'",
+                "export DEBUG='true'",
+                "export LOG_LEVEL='debug'",
+                "export DB_HOST='localhost'",
+                "export DB_PORT='5432'",
+                "export DB_NAME='myapp_dev'",
+            ]
+        )
     )
 
-    print("Development environment configured:")
+    print("Development environment configured:", file=out)
     for key in ["ENV", "DEBUG", "LOG_LEVEL", "DB_HOST", "DB_PORT", "DB_NAME"]:
-        print(f"  {key}={shell.getenv(key)}")
+        print(f"  {key}={shell.getenv(key)}", file=out)
 
     # Fork production environment
-    print("\nCreating production fork...")
+    print("\nCreating production fork...", file=out)
     prod = shell.fork()
 
     # Update production settings
@@ -124,37 +130,37 @@ async def example_complex_setup():
     await prod.execute("export LOG_LEVEL='error'")
     await prod.execute("export DB_HOST='prod.db.example.com'")
 
-    print("Production environment:")
+    print("Production environment:", file=out)
     for key in ["ENV", "DEBUG", "LOG_LEVEL", "DB_HOST", "DB_PORT", "DB_NAME"]:
-        print(f"  {key}={prod.getenv(key)}")
+        print(f"  {key}={prod.getenv(key)}", file=out)
 
-    print("\nDevelopment environment (unchanged):")
+    print("\nDevelopment environment (unchanged):", file=out)
     for key in ["ENV", "DEBUG", "LOG_LEVEL", "DB_HOST", "DB_PORT", "DB_NAME"]:
-        print(f"  {key}={shell.getenv(key)}")
+        print(f"  {key}={shell.getenv(key)}", file=out)
 
     shell.close()
     prod.close()
-    print()
+    print(file=out)
 
 
-async def example_tracking_disabled():
+async def example_tracking_disabled(base, out):
     """Example: Disabling environment sync for performance"""
-    print("=== Example 5: Disabling Environment Sync ===")
+    print("=== Example 5: Disabling Environment Sync ===", file=out)
 
-    shell = await create_shell()
+    shell = base.fork()
 
     # Execute without tracking environment
-    print("1. Executing without env tracking...")
+    print("1. Executing without env tracking...", file=out)
     result = await shell.execute("export NO_TRACK='should_not_appear'", sync_env=False)
-    print(f"   Variable tracked: {shell.getenv('NO_TRACK')}")
+    print(f"   Variable tracked: {shell.getenv('NO_TRACK')}", file=out)
 
     # Execute with tracking
-    print("\n2. Executing with env tracking...")
+    print("\n2. Executing with env tracking...", file=out)
     result = await shell.execute("export TRACKED='will_appear'", sync_env=True)
-    print(f"   Variable tracked: {shell.getenv('TRACKED')}")
+    print(f"   Variable tracked: {shell.getenv('TRACKED')}", file=out)
 
     shell.close()
-    print()
+    print(file=out)
 
 
 async def main():
@@ -171,15 +177,26 @@ async def main():
         example_tracking_disabled,
     ]
 
-    for example in examples:
-        try:
-            await example()
-            await asyncio.sleep(0.1)  # Small delay between examples
-        except Exception as e:
-            print(f"Error in {example.__name__}: {e}")
-            import traceback
+    # Each example writes to its own buffer, so they can run concurrently
+    # and still print in order
+    outputs = [io.StringIO() for _ in examples]
+
+    # One persistent shell shared by all examples; each example forks it,
+    # so they don't share state
+    base = await create_shell()
+
+    results = await asyncio.gather(
+        *(example(base, out) for example, out in zip(examples, outputs)),
+        return_exceptions=True,
+    )
+
+    base.close()
 
-            traceback.print_exc()
+    for example, out, error in zip(examples, outputs, results):
+        print(out.getvalue(), end="")
+        if isinstance(error, Exception):
+            print(f"Error in {example.__name__}: {error}")
+            traceback.print_exception(error)
 
     print("=" * 60)
     print("All advanced examples completed!")
@@ -4,130 +4,143 @@ Basic usage example for tingly-agent-shell
 """
 
 import asyncio
+import io
+
 from tingly_agent_shell import create_shell, execute_command
 
 
-async def example_1_basic_execution():
+async def example_1_basic_execution(out):
     """Example 1: Execute a simple command"""
-    print("=== Example 1: Basic Command Execution ===")
+    print("=== Example 1: Basic Command Execution ===", file=out)
     result = await execute_command("echo 'Hello, World!'")
-    print(f"Output: {result.stdout}")
-    print(f"Exit code: {result.returncode}")
-    print()
+    print(f"Output: {result.stdout}", file=out)
+    print(f"Exit code: {result.returncode}", file=out)
+    print(file=out)
 
 
-async def example_2_shell_with_env():
-    """Example 2: Create shell with custom environment"""
-    print("=== Example 2: Shell with Custom Environment ===")
-    shell = await create_shell(
-        environment={"MY_VAR": "my_value", "APP_NAME": "TinglyAgent"}
-    )
+async def example_2_shell_with_env(shell, out):
+    """Example 2: Fork shell with custom environment"""
+    print("=== Example 2: Shell with Custom Environment ===", file=out)
+    child = shell.fork()
+    child.setenv("MY_VAR", "my_value")
+    child.setenv("APP_NAME", "TinglyAgent")
 
-    result = await shell.execute("echo $MY_VAR $APP_NAME")
-    print(f"Output: {result.stdout}")
+    result = await child.execute("echo $MY_VAR $APP_NAME")
+    print(f"Output: {result.stdout}", file=out)
 
-    shell.close()
-    print()
+    child.close()
+    print(file=out)
 
 
-async def example_3_shell_forking():
+async def example_3_shell_forking(shell, out):
     """Example 3: Fork shell with state inheritance"""
-    print("=== Example 3: Shell Forking and State Inheritance ===")
-    parent = await create_shell(environment={"PARENT_VAR": "parent_value"})
+    print("=== Example 3: Shell Forking and State Inheritance ===", file=out)
+    parent = shell.fork()
+    parent.setenv("PARENT_VAR", "parent_value")
 
     # Execute in parent
     result = await parent.execute("echo Parent: $PARENT_VAR")
-    print(result.stdout)
+    print(result.stdout, file=out)
 
     # Fork child shell
     child = parent.fork()
 
     # Execute in child - should have access to PARENT_VAR
     result = await child.execute("echo Child: $PARENT_VAR")
-    print(result.stdout)
+    print(result.stdout, file=out)
 
     # Set new variable in child
     child.setenv("CHILD_VAR", "child_value")
 
     # Verify parent doesn't have CHILD_VAR
     result = await parent.execute("echo Parent CHILD_VAR: $CHILD_VAR")
-    print(result.stdout)
+    print(result.stdout, file=out)
 
     # Verify child has CHILD_VAR
     result = await child.execute("echo Child CHILD_VAR: $CHILD_VAR")
-    print(result.stdout)
+    print(result.stdout, file=out)
 
     parent.close()
     child.close()
-    print()
+    print(file=out)
 
 
-async def example_4_context_manager():
+async def example_4_context_manager(shell, out):
     """Example 4: Using context manager for automatic cleanup"""
-    print("=== Example 4: Context Manager ===")
-    async with await create_shell() as shell:
-        result = await shell.execute("pwd")
-        print(f"Current directory: {result.stdout.strip()}")
+    print("=== Example 4: Context Manager ===", file=out)
+    async with shell.fork() as child:
+        result = await child.execute("pwd")
+        print(f"Current directory: {result.stdout.strip()}", file=out)
 
-        result = await shell.execute("whoami")
-        print(f"Current user: {result.stdout.strip()}")
-    print()
+        result = await child.execute("whoami")
+        print(f"Current user: {result.stdout.strip()}", file=out)
+    print(file=out)
 
 
-async def example_5_timeout():
+async def example_5_timeout(shell, out):
     """Example 5: Command timeout handling"""
-    print("=== Example 5: Timeout Handling ===")
-    shell = await create_shell()
+    print("=== Example 5: Timeout Handling ===", file=out)
+    # Use a fork so the killed command cannot disturb the shared shell
+    child = shell.fork()
 
     try:
         # This command will timeout
-        result = await shell.execute("sleep 3", timeout=1.0)
-        print("Command completed (this shouldn't happen)")
+        result = await child.execute("sleep 3", timeout=1.0)
+        print("Command completed (this shouldn't happen)", file=out)
     except asyncio.TimeoutError:
-        print("Command timed out as expected!")
+        print("Command timed out as expected!", file=out)
 
-    shell.close()
-    print()
+    child.close()
+    print(file=out)
 
 
-async def example_6_error_handling():
+async def example_6_error_handling(shell, out):
     """Example 6: Error handling and exit codes"""
-    print("=== Example 6: Error Handling ===")
-    shell = await create_shell()
-
+    print("=== Example 6: Error Handling ===", file=out)
     # Execute a command that fails
     result = await shell.execute("ls /nonexistent", check=False)
-    print(f"Exit code: {result.returncode}")
-    print(f"Error: {result.stderr.strip()}")
+    print(f"Exit code: {result.returncode}", file=out)
+    print(f"Error: {result.stderr.strip()}", file=out)
+    print(file=out)
 
-    shell.close()
-    print()
 
-
-async def example_7_command_state():
+async def example_7_command_state(shell, out):
     """Example 7: Commands maintain state"""
-    print("=== Example 7: Command State Persistence ===")
-    async with await create_shell(shell_type="bash") as shell:
+    print("=== Example 7: Command State Persistence ===", file=out)
+    async with shell.fork() as child:
         # Set a variable
-        await shell.execute("export MY_VAR='Hello from shell'")
+        await child.execute("export MY_VAR='Hello from shell'")
         # Use it in next command
-        result = await shell.execute("echo $MY_VAR")
-        print(f"Output: {result.stdout.strip()}")
-    print()
+        result = await child.execute("echo $MY_VAR")
+        print(f"Output: {result.stdout.strip()}", file=out)
+    print(file=out)
 
 
 async def main():
     """Run all examples"""
     print("Tingly Agent Shell - Basic Usage Examples\n")
 
-    await example_1_basic_execution()
-    await example_2_shell_with_env()
-    await example_3_shell_forking()
-    await example_4_context_manager()
-    await example_5_timeout()
-    await example_6_error_handling()
-    await example_7_command_state()
+    examples = [
+        example_2_shell_with_env,
+        example_3_shell_forking,
+        example_4_context_manager,
+        example_5_timeout,
+        example_6_error_handling,
+        example_7_command_state,
+    ]
+    # Each example writes to its own buffer, so they can run concurrently
+    # and still print in order
+    outputs = [io.StringIO() for _ in range(len(examples) + 1)]
+
+    # One persistent shell shared by all examples; each forks it for isolation
+    async with await create_shell(shell_type="bash") as shell:
+        await asyncio.gather(
+            example_1_basic_execution(outputs[0]),
+            *(example(shell, out) for example, out in zip(examples, outputs[1:])),
+        )
 
+    for out in outputs:
+        print(out.getvalue(), end="")
     print("All examples completed!")
 
 
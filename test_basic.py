@@ -4,11 +4,34 @@ Basic test for tingly-agent-shell module
 """
 
 import asyncio
+import dataclasses
+import gc
+import inspect
+import os
+import signal
 import sys
+import tempfile
+import time
+from pathlib import Path
 
 import pytest
 
-from tingly_agent_shell import Shell, ShellConfig, create_shell, execute_command
+from tingly_agent_shell import (
+    BashDaemon,
+    CommandValidator,
+    EchoMarkerHook,
+    ExecuteResult,
+    SessionShell,
+    Shell,
+    ShellConfig,
+    ShellPool,
+    StateShell,
+    create_shell,
+    drain_reapers,
+    execute_command,
+)
+from tingly_agent_shell.base import _simple_argv
+from tingly_agent_shell.state_shell import _extract_block
 
 
 @pytest.mark.asyncio
@@ -18,6 +41,27 @@ async def test_basic_execution():
     result = await execute_command("echo 'Hello, World!'")
     assert result.returncode == 0
     assert "Hello, World!" in result.stdout
+
+    # Later calls are served by shells the pool started in the background
+    results = await asyncio.gather(
+        *(
+            execute_command(f'echo "$N{i}"; exit {i}', environment={f"N{i}": str(i)})
+            for i in range(6)
+        )
+    )
+    assert [(r.returncode, r.stdout) for r in results] == [
+        (i, f"{i}\n") for i in range(6)
+    ]
+
+    # Pre-started shells still run in the caller's current directory
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        try:
+            result = await execute_command("pwd")
+            assert result.stdout == f"{os.getcwd()}\n"
+        finally:
+            os.chdir(old_cwd)
     print("✓ Basic execution works")
 
 
@@ -34,10 +78,10 @@ async def test_shell_creation():
 
 
 @pytest.mark.asyncio
-async def test_environment_variables():
+async def test_environment_variables(shared_shell):
     """Test environment variable management"""
     print("Testing environment variables...")
-    shell = await create_shell()
+    shell = shared_shell.fork()
 
     # Set and get env var
     shell.setenv("CUSTOM_VAR", "custom_value")
@@ -82,10 +126,10 @@ async def test_shell_forking():
 
 
 @pytest.mark.asyncio
-async def test_timeout():
+async def test_timeout(shared_shell):
     """Test timeout functionality"""
     print("Testing timeout...")
-    shell = await create_shell()
+    shell = shared_shell.fork()
 
     try:
         await shell.execute("sleep 5", timeout=0.5)
@@ -97,28 +141,45 @@ async def test_timeout():
 
 
 @pytest.mark.asyncio
-async def test_context_manager():
+async def test_context_manager(shared_shell):
     """Test context manager"""
     print("Testing context manager...")
-    async with await create_shell() as shell:
+    async with shared_shell.fork() as shell:
         result = await shell.execute("echo 'Context test'")
         assert result.returncode == 0
     print("✓ Context manager works")
 
 
 @pytest.mark.asyncio
-async def test_command_execution():
+async def test_command_execution(shared_shell):
     """Test command execution in shell"""
     print("Testing command execution...")
-    async with await create_shell() as shell:
+    async with shared_shell.fork() as shell:
         # Test successful command
         result = await shell.execute("pwd", check=False)
         assert result.returncode == 0
         assert len(result.stdout) > 0
 
+        # Non-ASCII output decodes from the raw bytes
+        result = await shell.execute("printf 'caf\\303\\251'", check=False)
+        assert result.stdout_bytes == "café".encode("utf-8")
+        assert result.stdout == "café"
+
+        # Output is replaced through the raw field; text and bytes clash
+        edited = dataclasses.replace(result, stdout_bytes=b"new")
+        assert edited.stdout == "new"
+        with pytest.raises(TypeError):
+            dataclasses.replace(result, stdout="new")
+
         # Test failed command
         result = await shell.execute("exit 42", check=False)
         assert result.returncode == 42
+
+        # Probes are cached until PATH changes
+        assert await shell.test_command("sh")
+        assert not await shell.test_command("no-such-command-here")
+        shell.setenv("PATH", "")
+        assert not await shell.test_command("sh")
     print("✓ Command execution works")
 
 
@@ -183,6 +244,35 @@ async def test_non_persistent_shell():
         assert result2.returncode == 0
         assert "Command 2" in result2.stdout
 
+        # Simple commands run without a shell in between, in the workdir
+        shell.config.workdir = "/"
+        result3 = await shell.execute("ls -d bin", timeout=5.0)
+        assert (result3.returncode, result3.stdout) == (0, "bin\n")
+
+        result4 = await shell.execute("no-such-command-here", timeout=5.0)
+        assert result4.returncode == 127
+
+        # Relative program paths resolve against the workdir, not Python's cwd
+        with tempfile.TemporaryDirectory() as wd, tempfile.TemporaryDirectory() as cwd:
+            for directory in (wd, cwd):
+                script = os.path.join(directory, "run.sh")
+                with open(script, "w") as f:
+                    f.write(f"#!/bin/sh\necho {directory}\n")
+                os.chmod(script, 0o755)
+            old_cwd = os.getcwd()
+            os.chdir(cwd)
+            try:
+                shell.config.workdir = wd
+                result5 = await shell.execute("./run.sh", timeout=5.0)
+                assert result5.stdout == f"{wd}\n"
+
+                # Absolute paths still skip the shell
+                assert _simple_argv(script, None) == (script, [script])
+                result6 = await shell.execute(script, timeout=5.0)
+                assert result6.stdout == f"{cwd}\n"
+            finally:
+                os.chdir(old_cwd)
+
     print("✓ Non-persistent shell mode works")
 
 
@@ -226,9 +316,317 @@ async def test_persistent_shell_state_preservation():
         result2 = await shell.execute("pwd", timeout=5.0)
         assert result2.returncode == 0
 
+        # Shell state carries over between commands
+        await shell.execute("cd /tmp && SHELL_LOCAL=kept", timeout=5.0)
+        result3 = await shell.execute('echo "$PWD $SHELL_LOCAL"', timeout=5.0)
+        assert result3.stdout == "/tmp kept\n"
+
+        # Variables set from Python reach the running shell
+        shell.setenv("STATE_VAR", "changed value")
+        result4 = await shell.execute('echo "$STATE_VAR"', timeout=5.0)
+        assert result4.stdout == "changed value\n"
+
+        # Exiting ends the shell; the next command gets a fresh one
+        result5 = await shell.execute("echo bye; exit 7", timeout=5.0)
+        assert (result5.returncode, result5.stdout) == (7, "bye\n")
+        result6 = await shell.execute('echo "$STATE_VAR"', timeout=5.0)
+        assert result6.stdout == "changed value\n"
+
+        # A shell killed between commands is replaced, not reported as output
+        os.killpg(shell._process.pid, signal.SIGKILL)
+        await asyncio.sleep(0.1)
+        result7 = await shell.execute('echo "$STATE_VAR"', timeout=5.0)
+        assert (result7.returncode, result7.stdout) == (0, "changed value\n")
+
     print("✓ Persistent shell state preservation works")
 
 
+@pytest.mark.asyncio
+async def test_execute_script(shared_shell):
+    """Test running a script file, made executable only when needed"""
+    print("Testing execute_script...")
+    tmp_dir = tempfile.TemporaryDirectory()
+    script = Path(tmp_dir.name) / "hello.sh"
+    script.write_text("#!/bin/sh\necho from script\n")
+    script.chmod(0o644)
+
+    with tmp_dir:
+        async with shared_shell.fork() as shell:
+            result = await shell.execute_script(str(script), timeout=5.0)
+            assert result.stdout == "from script\n"
+            assert script.stat().st_mode & 0o777 == 0o755
+
+            # Already executable: the mode is left alone
+            script.chmod(0o711)
+            result = await shell.execute_script(str(script), timeout=5.0)
+            assert result.returncode == 0
+            assert script.stat().st_mode & 0o777 == 0o711
+
+            # Paths with quotes are passed to the shell intact
+            quoted = script.rename(Path(tmp_dir.name) / "it's here.sh")
+            result = await shell.execute_script(str(quoted), timeout=5.0)
+            assert result.stdout == "from script\n"
+
+    print("✓ execute_script works")
+
+
+@pytest.mark.asyncio
+async def test_spawn_in_executor():
+    """Test one-off processes created in a worker thread"""
+    print("Testing spawn in executor...")
+
+    config = ShellConfig(persistent=False, spawn_in_executor=True)
+    async with Shell(config=config) as shell:
+        result = await shell.execute("echo out; echo err >&2; exit 4", timeout=5.0)
+        assert result.returncode == 4
+        assert (result.stdout, result.stderr) == ("out\n", "err\n")
+
+        result = await shell.execute("ls -d /", timeout=5.0)
+        assert (result.returncode, result.stdout) == (0, "/\n")
+
+        try:
+            await shell.execute("sleep 5", timeout=0.5)
+            assert False, "Should have timed out"
+        except asyncio.TimeoutError:
+            pass
+
+    print("✓ Spawn in executor works")
+
+
+@pytest.mark.asyncio
+async def test_max_output_bytes():
+    """Test that only the tail of large output is kept"""
+    print("Testing output cap...")
+
+    command = "head -c 300000 /dev/zero | tr '\\0' a; printf END; printf ERR >&2"
+    modes = [
+        {"persistent": True},
+        {"persistent": False},
+        {"multiplex": True},
+        {"pooled": True},
+    ]
+    for mode in modes:
+        config = ShellConfig(max_output_bytes=5, **mode)
+        async with Shell(config=config) as shell:
+            result = await shell.execute(command, timeout=5.0)
+            assert result.returncode == 0
+            assert (result.stdout, result.stderr) == ("aaEND", "ERR"), mode
+    await BashDaemon.get().close()
+
+    print("✓ Output cap works")
+
+
+@pytest.mark.asyncio
+async def test_multiplexed_shell():
+    """Test commands forked from the shared bash daemon"""
+    print("Testing multiplexed shell...")
+
+    config = ShellConfig(multiplex=True, environment={"MUX_VAR": "it's muxed"})
+    async with Shell(config=config) as shell:
+        result = await shell.execute("echo \"$MUX_VAR\"; echo oops >&2; exit 3")
+        assert result.returncode == 3
+        assert result.stdout == "it's muxed\n"
+        assert result.stderr == "oops\n"
+
+        try:
+            await shell.execute("sleep 5", timeout=0.5)
+            assert False, "Should have timed out"
+        except asyncio.TimeoutError:
+            pass
+
+        # The daemon restarts after a timeout
+        result = await shell.execute("pwd", timeout=5.0)
+        assert result.returncode == 0
+
+        # Time spent queued behind another shell's command counts too
+        other = Shell(config=ShellConfig(multiplex=True))
+        slow = asyncio.create_task(other.execute("sleep 1; true"))
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        try:
+            await shell.execute("true", timeout=0.3)
+            assert False, "Should have timed out"
+        except asyncio.TimeoutError:
+            pass
+        assert time.monotonic() - start < 0.8
+        assert (await slow).returncode == 0
+        other.close()
+
+    await BashDaemon.get().close()
+    print("✓ Multiplexed shell works")
+
+
+@pytest.mark.asyncio
+async def test_pool_closes_with_loop():
+    """Test that idle pooled shells are stopped when asyncio.run() ends"""
+    print("Testing pool shutdown with the event loop...")
+
+    async def run_pooled():
+        result = await execute_command("echo pooled; true")
+        assert result.stdout == "pooled\n"
+        # Let the pool refill, so there are idle shells to stop
+        await asyncio.sleep(0.2)
+        return [process.pid for process in ShellPool.get()._idle]
+
+    # asyncio.run can't nest, so the pool lives on a loop in another thread
+    pids = await asyncio.to_thread(asyncio.run, run_pooled())
+    assert pids
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    print("✓ Pool shutdown with the event loop works")
+
+
+@pytest.mark.asyncio
+async def test_session_close_reaps_in_background():
+    """Test that close() leaves the session process to the reaper"""
+    print("Testing session shell close...")
+
+    shell = SessionShell()
+    result = await shell.execute("echo session", timeout=5.0)
+    assert result.stdout == "session\n"
+
+    process = shell._persistent_process
+    shell.close()
+    await drain_reapers()
+    assert process.returncode is not None
+
+    print("✓ Session shell close works")
+
+
+@pytest.mark.asyncio
+# asyncio's own transport finalizers complain about the closed loop
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+async def test_close_after_loop_ends():
+    """Test that close() works once the shell's event loop is gone"""
+    print("Testing close after the event loop ends...")
+
+    def run_then_close():
+        shell = Shell(config=ShellConfig(persistent=True))
+        session = SessionShell()
+
+        async def start():
+            await shell.execute("echo hi")
+            await session.execute("echo hi")
+
+        asyncio.run(start())
+        pids = (shell._process.pid, session._persistent_process.pid)
+        shell.close()
+        session.close()
+        return pids
+
+    # asyncio.run can't nest, so the shells live on a loop in another thread
+    pids = await asyncio.to_thread(run_then_close)
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    # Finalize the dead loop's transports while the warning filter applies
+    gc.collect()
+
+    print("✓ Close after the event loop ends works")
+
+
+@pytest.mark.asyncio
+async def test_session_stderr():
+    """Test that session stderr is framed per command"""
+    print("Testing session shell stderr...")
+
+    shell = SessionShell()
+    try:
+        result = await shell.execute("echo out; echo err >&2; false", timeout=5.0)
+        assert result.stdout == "out\n"
+        assert result.stderr == "err\n"
+        assert result.returncode == 1
+
+        # A timed-out command's late output must not leak into the next one
+        result = await shell.execute("echo early >&2; sleep 0.3; echo late >&2", timeout=0.1)
+        assert result.stderr == "early\n"
+        await asyncio.sleep(0.3)
+        result = await shell.execute("echo next >&2", timeout=5.0)
+        assert result.stderr == "next\n"
+    finally:
+        shell.close()
+
+    print("✓ Session shell stderr works")
+
+
+@pytest.mark.asyncio
+async def test_echo_marker_hook():
+    """Test that marker lines are stripped from hooked command output"""
+    print("Testing echo marker hook...")
+
+    hook = EchoMarkerHook()
+    async with Shell(config=ShellConfig(hooks=[hook])) as shell:
+        result = await shell.execute("echo one; echo two")
+        assert result.stdout == "one\ntwo"
+        assert result.command == "echo one; echo two"
+
+    start, end = "CMD_MARKER_START_7_abc", "CMD_MARKER_END_7_abc"
+    clean = hook._clean_markers
+    # Whole lines go, even with the marker mid-line; other markers stay
+    assert clean(f"a\nx {start} y\nb\n=== {end} ===\n", "7_abc", None) == "a\nb"
+    assert clean(f"CMD_MARKER_START_8_abc\n{start}", "7_abc", None) == "CMD_MARKER_START_8_abc"
+    assert clean(f"{start} {end}\nq", "7_abc", None) == "q"
+    # Any str.splitlines line break ends a line, normalized to "\n"
+    assert clean(f"=== {start} ===\r\na\r\nb\r\n=== {end} ===\r\n", "7_abc", None) == "a\nb"
+    assert clean(f"x\r{end}\ry", "7_abc", None) == "x\ny"
+    assert clean("", "7_abc", None) == ""
+
+    print("✓ Echo marker hook works")
+
+
+@pytest.mark.asyncio
+async def test_command_validator():
+    """Test that the validator wants the end marker after the start marker"""
+    print("Testing command validator...")
+
+    hook = EchoMarkerHook()
+    context = {}
+    await hook.pre_execute("true", context)
+    start = context["_echo_marker_start_str"]
+    end = context["_echo_marker_end_str"]
+
+    def issues(stdout):
+        result = ExecuteResult("true", 0, stdout, "", 0.0)
+        return CommandValidator(hook).validate_execution("true", result, context)["issues"]
+
+    assert issues(f"{start}\nout\n{end}\n") == []
+    assert issues(f"{end}\n{start}\n") == ["Missing end marker"]
+    assert issues(f"{end}\n") == ["Missing start marker"]
+    assert issues("out\n") == ["Missing start marker", "Missing end marker"]
+
+    print("✓ Command validator works")
+
+
+@pytest.mark.asyncio
+async def test_state_shell_tracking():
+    """Test that StateShell extracts pwd and env from its tracking output"""
+    print("Testing state shell tracking...")
+
+    shell = StateShell()
+    try:
+        result = await shell.execute("cd /tmp && export STATE_VAR='a b'; echo out; false")
+        assert result.returncode == 1
+        assert result.stdout.startswith("out\n")
+        assert shell.get_pwd() == "/tmp"
+        assert shell.getenv("STATE_VAR") == "a b"
+
+        state = shell.get_state()
+        assert (state.pwd, state.env["STATE_VAR"]) == ("/tmp", "a b")
+    finally:
+        shell.close()
+
+    # Blocks are found in order; a missing end marker yields nothing
+    output = "=== STATE_PWD_START ===\n/x\n=== STATE_PWD_END ===\n=== STATE_ENV_START ===\nE"
+    pwd, pos = _extract_block(output, "=== STATE_PWD_START ===", "=== STATE_PWD_END ===")
+    assert pwd == "/x"
+    env = _extract_block(output, "=== STATE_ENV_START ===", "=== STATE_ENV_END ===", pos)
+    assert env == (None, pos)
+
+    print("✓ State shell tracking works")
+
+
 async def main():
     """Run all tests"""
     print("=" * 50)
@@ -249,16 +647,36 @@ async def main():
         test_non_persistent_shell,
         test_persistent_shell_with_pre_scripts,
         test_persistent_shell_state_preservation,
+        test_execute_script,
+        test_spawn_in_executor,
+        test_max_output_bytes,
+        test_multiplexed_shell,
+        test_pool_closes_with_loop,
+        test_session_close_reaps_in_background,
+        test_close_after_loop_ends,
+        test_session_stderr,
+        test_echo_marker_hook,
+        test_command_validator,
+        test_state_shell_tracking,
     ]
 
+    # One shell for the whole run; tests that need isolation fork it
+    shared_shell = Shell(config=ShellConfig(persistent=True))
+
     failed = []
     for test in tests:
         try:
-            await test()
+            if "shared_shell" in inspect.signature(test).parameters:
+                await test(shared_shell)
+            else:
+                await test()
         except Exception as e:
             print(f"✗ {test.__name__} failed: {e}")
             failed.append((test.__name__, e))
 
+    shared_shell.close()
+    await drain_reapers()
+
     print()
     print("=" * 50)
     if failed:
@@ -272,4 +690,11 @@ async def main():
 
 
 if __name__ == "__main__":
+    # uvloop's C-level subprocess transport is cheaper per spawn; use it if installed
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
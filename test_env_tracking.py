@@ -4,17 +4,20 @@ Test environment variable tracking and setup_rc features
 """
 
 import asyncio
+import inspect
+import os
+import tempfile
 
 import pytest
 
-from tingly_agent_shell import create_shell
+from tingly_agent_shell import Shell, ShellConfig, StateShell, create_shell
 
 
 @pytest.mark.asyncio
-async def test_env_var_tracking():
+async def test_env_var_tracking(shared_shell):
     """Test that environment variables set via export are tracked"""
     print("Testing environment variable tracking...")
-    shell = await create_shell()
+    shell = shared_shell.fork()
 
     # Set an environment variable using export
     await shell.execute("export MY_VAR='test_value'")
@@ -26,6 +29,18 @@ async def test_env_var_tracking():
     print(f"MY_VAR after update: {shell.getenv('MY_VAR')}")
     assert shell.getenv("MY_VAR") == "updated_value", "MY_VAR should be updated"
 
+    # Literal exports skip the subprocess but still reach later commands
+    result = await shell.execute('export GREETING="hello world"')
+    assert result.returncode == 0
+    result = await shell.execute('echo "$GREETING"')
+    assert result.stdout == "hello world\n"
+
+    # Several assignments, quoted spaces and command separators in one line
+    await shell.execute("export A_ONE=1 A_TWO='two words'; echo export A_NOT=1")
+    assert shell.getenv("A_ONE") == "1"
+    assert shell.getenv("A_TWO") == "two words"
+    assert shell.getenv("A_NOT") is None
+
     # Set PATH variable
     await shell.execute("export PATH='/custom/path:$PATH'")
     path = shell.getenv("PATH")
@@ -54,15 +69,26 @@ async def test_pre_scripts():
     print(f"ANOTHER_VAR: {shell.getenv('ANOTHER_VAR')}")
 
     shell.close()
+
+    # A script that ends the batch runs once; the ones after it still run
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, "log")
+        shell = await create_shell(
+            pre_scripts=[f"echo once >> {log}; exit 0", "export AFTER_EXIT='yes'"]
+        )
+        with open(log) as f:
+            assert f.read() == "once\n"
+        assert shell.getenv("AFTER_EXIT") == "yes"
+        shell.close()
     print("✓ setup_rc works\n")
 
 
 @pytest.mark.asyncio
-async def test_fork_inherits_env():
+async def test_fork_inherits_env(shared_shell):
     """Test that forked shell inherits environment changes"""
     print("Testing fork inherits environment changes...")
 
-    parent = await create_shell()
+    parent = shared_shell.fork()
 
     # Set variable in parent
     await parent.execute("export PARENT_VAR='parent_value'")
@@ -90,8 +116,14 @@ async def test_fork_inherits_env():
         child.getenv("PARENT_VAR") == "parent_value"
     ), "Child should still have PARENT_VAR"
 
+    # A fork's config environment goes on top of the inherited one
+    configured = parent.fork(ShellConfig(environment={"PARENT_VAR": "override"}))
+    assert configured.getenv("PARENT_VAR") == "override"
+    assert parent.getenv("PARENT_VAR") == "parent_value"
+
     parent.close()
     child.close()
+    configured.close()
     print("✓ Fork inherits environment changes\n")
 
 
@@ -121,6 +153,96 @@ async def test_multiple_setup_commands():
     print("✓ Multiple setup commands work\n")
 
 
+@pytest.mark.asyncio
+async def test_unset_assign_and_cd_tracking(shared_shell):
+    """Test that unset, plain assignments and cd are tracked without a sync"""
+    print("Testing unset/assignment/cd tracking...")
+    shell = shared_shell.fork()
+    shell.setenv("KEEP_ME", "1")
+    shell.setenv("DROP_ME", "1")
+
+    await shell.execute("unset DROP_ME; KEEP_ME=2; LOCAL_ONLY=3")
+    assert shell.getenv("DROP_ME") is None
+    assert shell.getenv("KEEP_ME") == "2"
+    # Not exported, so not part of the environment
+    assert shell.getenv("LOCAL_ONLY") is None
+
+    await shell.execute("cd /tmp")
+    assert shell.get_config().workdir == "/tmp"
+
+    # Effects that can't be parsed are picked up by an explicit refresh
+    await shell.execute("eval \"$(printf 'export %s=%s' FROM_EVAL yes)\"")
+    assert shell.getenv("FROM_EVAL") is None
+    await shell.refresh_env()
+    assert shell.getenv("FROM_EVAL") == "yes"
+
+    # A refresh corrects predictive tracking even when the dump is unchanged
+    for _ in range(2):
+        await shell.execute("export FROM_UNDEFINED=$TINGLY_NOPE_UNDEFINED")
+        await shell.refresh_env()
+        assert shell.getenv("FROM_UNDEFINED") == ""
+
+    shell.close()
+    print("✓ Unset/assignment/cd tracking works\n")
+
+
+@pytest.mark.asyncio
+async def test_state_shell_env_dump():
+    """Test that StateShell corrects predictive tracking from its env dump"""
+    print("Testing StateShell env dump...")
+
+    shell = StateShell()
+    try:
+        # The second run leaves the dump unchanged but must still win over
+        # the literal value predicted from the command
+        for _ in range(2):
+            await shell.execute("export FROM_UNDEFINED=$TINGLY_NOPE_UNDEFINED")
+            assert shell.getenv("FROM_UNDEFINED") == ""
+    finally:
+        shell.close()
+
+    print("✓ StateShell env dump works\n")
+
+
+@pytest.mark.asyncio
+async def test_single_quoted_path_export():
+    """Test that a single-quoted $PATH export leaves commands runnable"""
+    print("Testing single-quoted PATH export...")
+
+    for persistent in (True, False):
+        shell = Shell(config=ShellConfig(persistent=persistent))
+        try:
+            await shell.execute("export PATH='/custom/bin:$PATH'")
+            path = shell.getenv("PATH")
+            assert path.startswith("/custom/bin:") and "$PATH" not in path
+
+            result = await shell.execute("ls /")
+            assert result.returncode == 0, result.stderr
+        finally:
+            await shell.async_close()
+
+    print("✓ Single-quoted PATH export works\n")
+
+
+@pytest.mark.asyncio
+async def test_export_in_compound_commands(shared_shell):
+    """Test that exports after newlines, keywords and assignments are tracked"""
+    print("Testing exports inside compound commands...")
+    shell = shared_shell.fork()
+
+    await shell.execute("echo a\nexport NEWLINE_VAR=1")
+    await shell.execute("if true; then export IF_VAR=2; fi")
+    await shell.execute("for i in 1; do export LOOP_VAR=3; done")
+    await shell.execute("PREFIX=1 export PREFIXED_VAR=4")
+    assert shell.getenv("NEWLINE_VAR") == "1"
+    assert shell.getenv("IF_VAR") == "2"
+    assert shell.getenv("LOOP_VAR") == "3"
+    assert shell.getenv("PREFIXED_VAR") == "4"
+
+    shell.close()
+    print("✓ Exports inside compound commands are tracked\n")
+
+
 async def main():
     """Run all tests"""
     print("=" * 60)
@@ -133,11 +255,21 @@ async def main():
         test_pre_scripts,
         test_fork_inherits_env,
         test_multiple_setup_commands,
+        test_unset_assign_and_cd_tracking,
+        test_state_shell_env_dump,
+        test_single_quoted_path_export,
+        test_export_in_compound_commands,
     ]
 
+    # One shell for the whole run; tests that need isolation fork it
+    shared_shell = Shell(config=ShellConfig(persistent=True))
+
     for test in tests:
         try:
-            await test()
+            if "shared_shell" in inspect.signature(test).parameters:
+                await test(shared_shell)
+            else:
+                await test()
         except Exception as e:
             print(f"✗ {test.__name__} failed: {e}")
             import traceback
@@ -145,6 +277,8 @@ async def main():
             traceback.print_exc()
             return 1
 
+    shared_shell.close()
+
     print("=" * 60)
     print("SUCCESS: All tests passed!")
     print("=" * 60)
@@ -152,5 +286,12 @@ async def main():
 
 
 if __name__ == "__main__":
+    # uvloop's C-level subprocess transport is cheaper per spawn; use it if installed
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
     exit_code = asyncio.run(main())
     exit(exit_code)
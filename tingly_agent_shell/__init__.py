@@ -8,15 +8,18 @@ Classes:
     AgentShell: General shell for agent use
     StateShell: Shell that tracks environment state and working directory
     SessionShell: Shell that maintains an interactive session
+    BashDaemon: Shared bash process that forks commands for multiplexed shells
+    ShellPool: Pre-started shells for pooled one-off commands
 
 Public Functions:
     create_shell: Create a new AgentShell
     create_state_shell: Create a new StateShell
     create_session_shell: Create a new SessionShell
     execute_command: Execute a single command in a temporary shell
+    drain_reapers: Wait for processes terminated by close() to be reaped
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 
 from .hooks import (
     CommandHook,
@@ -28,7 +31,8 @@ from .types import (
     ExecuteResult,
     ShellState,
 )
-from .base import AgentShell
+from .base import AgentShell, drain_reapers
+from .daemon import BashDaemon, ShellPool
 from .state_shell import StateShell
 from .session_shell import SessionShell
 
@@ -40,6 +44,42 @@ Shell = AgentShell
 # Public Utility Functions
 # ============================================================================
 
+_SHELL_CLASSES = {
+    "agent": AgentShell,
+    "state": StateShell,
+    "session": SessionShell,
+}
+
+
+def _create(
+    kind: str,
+    shell_type: str,
+    environment: Optional[Dict[str, str]],
+    pre_scripts: Optional[List[str]],
+    workdir: Optional[str],
+) -> Union[AgentShell, StateShell, SessionShell]:
+    """
+    Create a shell of the given kind from the create_* arguments.
+
+    Args:
+        kind: Key of the shell class in _SHELL_CLASSES
+        shell_type: Type of shell (bash, zsh, etc.)
+        environment: Environment variables to set
+        pre_scripts: List of setup commands/scripts to run
+        workdir: Working directory
+
+    Returns:
+        Shell instance of the requested kind
+    """
+    config = ShellConfig(
+        shell_type=shell_type,
+        environment=environment or {},
+        pre_scripts=pre_scripts or [],
+        workdir=workdir,
+    )
+    return _SHELL_CLASSES[kind](config=config)
+
+
 async def create_shell(
     shell_type: str = "bash",
     environment: Optional[Dict[str, str]] = None,
@@ -58,13 +98,7 @@ async def create_shell(
     Returns:
         AgentShell instance
     """
-    config = ShellConfig(
-        shell_type=shell_type,
-        environment=environment or {},
-        pre_scripts=pre_scripts or [],
-        workdir=workdir,
-    )
-    return AgentShell(config=config)
+    return _create("agent", shell_type, environment, pre_scripts, workdir)
 
 
 async def create_state_shell(
@@ -85,13 +119,7 @@ async def create_state_shell(
     Returns:
         StateShell instance
     """
-    config = ShellConfig(
-        shell_type=shell_type,
-        environment=environment or {},
-        pre_scripts=pre_scripts or [],
-        workdir=workdir,
-    )
-    return StateShell(config=config)
+    return _create("state", shell_type, environment, pre_scripts, workdir)
 
 
 async def create_session_shell(
@@ -112,13 +140,7 @@ async def create_session_shell(
     Returns:
         SessionShell instance
     """
-    config = ShellConfig(
-        shell_type=shell_type,
-        environment=environment or {},
-        pre_scripts=pre_scripts or [],
-        workdir=workdir,
-    )
-    return SessionShell(config=config)
+    return _create("session", shell_type, environment, pre_scripts, workdir)
 
 
 async def execute_command(
@@ -139,7 +161,9 @@ async def execute_command(
     Returns:
         ExecuteResult with command output and metadata
     """
-    async with await create_shell(environment=environment) as shell:
+    # A pooled shell runs the command in a shell started ahead of time
+    config = ShellConfig(environment=environment or {}, pooled=True)
+    async with AgentShell(config=config) as shell:
         return await shell.execute(command, timeout=timeout, check=check)
 
 
@@ -149,6 +173,8 @@ __all__ = [
     'StateShell',
     'SessionShell',
     'Shell',  # Backward compatibility alias
+    'BashDaemon',
+    'ShellPool',
 
     # Hooks
     'CommandHook',
@@ -165,4 +191,5 @@ __all__ = [
     'create_state_shell',
     'create_session_shell',
     'execute_command',
+    'drain_reapers',
 ]
@@ -3,16 +3,413 @@ Base AgentShell implementation.
 """
 
 import asyncio
+import hashlib
 import os
+import re
+import shlex
+import shutil
+import signal
+import stat
 import subprocess
 import time
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
-
+import uuid
+from collections import ChainMap
+from functools import lru_cache
+from string import Template
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from .daemon import BashDaemon, ShellPool
+from .process_io import IDENTIFIER, read_capped, read_until, tail
 from .types import ExecuteResult, ShellConfig
 
 if TYPE_CHECKING:
     from .hooks import CommandHook
 
+# Process environment snapshot shared as the bottom layer of every root shell,
+# so creating a shell does not copy os.environ
+_SYS_ENV = MappingProxyType(dict(os.environ))
+
+# Environment layers a shell may accumulate through forks before being flattened
+_MAX_ENV_LAYERS = 8
+
+# Background tasks waiting on processes terminated by a synchronous close()
+_REAPERS: Set[asyncio.Task] = set()
+
+# Fallback pattern for commands shlex can't split (unbalanced quotes):
+# export VAR="value", export VAR='value' or export VAR=value, in one pass
+_EXPORT_FUSED = re.compile(r"""export\s+(\w+)=(?:"([^"]*)"|'([^']*)'|(\S+))""")
+
+# First characters of shlex punctuation tokens (; & | ( ) < > and newline),
+# which end a simple command
+_SHELL_PUNCTUATION = frozenset("();<>|&\n")
+
+# Reserved words after which a new simple command starts
+_COMMAND_PREFIXES = frozenset(
+    ("if", "then", "elif", "else", "while", "until", "do", "{", "!", "time")
+)
+
+# Builtins that can change the exported environment: export, unset,
+# declare -x / typeset -x, source and its '.' shorthand, and plain
+# assignments (which change the env when the variable is already exported)
+_ENV_MUTATING = re.compile(
+    r"\b(?:export|unset|declare\s+-x|typeset\s+-x|source)\b|(?:^|[\s;&|(])\.\s"
+    r"|(?:^|[;&|\n]\s*)[A-Za-z_]\w*="
+)
+
+# unset VAR... (not unset -f, which removes functions)
+_UNSET_PATTERN = re.compile(
+    r"(?:^|[;&|\n]\s*)unset\s+(?:-v\s+)?((?:[A-Za-z_]\w*[ \t]*)+)"
+)
+
+# A standalone VAR=value, not a prefix assignment like `VAR=value cmd`
+_ASSIGN_PATTERN = re.compile(
+    r"""(?:^|[;&|\n]\s*)([A-Za-z_]\w*)=("[^"]*"|'[^']*'|[^\s;&|'"]*)(?=[ \t]*(?:$|[;&|\n]))"""
+)
+
+# cd with an optional single argument, run in this shell (not a subshell)
+# export KEY='...$...': the tracked value expands the variable while bash
+# keeps it literal, so the persistent shell is handed the tracked value
+_QUOTED_DOLLAR_EXPORT = re.compile(r"export\s+([A-Za-z_]\w*)='[^']*\$")
+
+_CD_PATTERN = re.compile(
+    r"(?:^|[;&|\n]\s*)cd(?:[ \t]+([^\s;&|]+))?(?=[ \t]*(?:$|[;&|\n]))"
+)
+
+# Lines of 'export -p' output: declare -x VAR="value" or export VAR="value"
+_DECLARE_X = re.compile(r'declare\s+-x\s+(\w+)="([^"]*)"|export\s+(\w+)="([^"]*)"')
+
+# Characters that need a shell to interpret them; commands without any of
+# them are plain argv lists and can be executed directly. A character class
+# scans the command in one C-level pass
+_SHELL_METACHARS = re.compile(r"""[|&;<>()$`\\"'*?\[\]{}#~=%!\n]""")
+
+# Builtins and keywords, which either only exist inside a shell or behave
+# differently from the program of the same name (pwd, echo, ...)
+_SHELL_BUILTINS = frozenset(
+    (
+        ". : [ alias bg bind break builtin caller case cd command compgen "
+        "complete compopt continue declare dirs disown echo enable eval exec "
+        "exit export false fc fg for function getopts hash help history if "
+        "jobs kill let local logout mapfile popd printf pushd pwd read "
+        "readarray readonly return select set shift shopt source suspend test "
+        "time times trap true type typeset ulimit umask unalias unset until "
+        "wait while"
+    ).split()
+)
+
+# A lone `export KEY=value` whose value needs no shell expansion; values
+# with $, ` or \ go through the shell even when single-quoted, so the
+# tracked value matches what the tracking of other exports would record
+_LITERAL_EXPORT = re.compile(
+    r"""\s*export\s+([A-Za-z_][A-Za-z0-9_]*)="""
+    r"""(?:'([^'$`\\]*)'|"([^"$`\\]*)"|([\w./:,+=@%-]*))\s*"""
+)
+
+
+class _EnvMap(ChainMap):
+    """
+    Layered environment mapping that counts its mutations.
+
+    The version lets a shell cache the flattened environment and rebuild it
+    only after something actually changed.
+    """
+
+    def __init__(self, *maps):
+        super().__init__(*maps)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def discard(self, key):
+        """
+        Remove a key if present, including one seen through a shared layer.
+
+        Shared layers are never modified; if the key is still visible after
+        removing it from the front layer, the layers are flattened into a
+        private one without it.
+        """
+        self.maps[0].pop(key, None)
+        if key in self:
+            flat = dict(self)
+            del flat[key]
+            self.maps[:] = [flat]
+        self.version += 1
+
+
+def _reap(process: asyncio.subprocess.Process) -> None:
+    """
+    Wait for a terminated process in the background.
+
+    Args:
+        process: Process that has been signalled to exit
+    """
+    try:
+        task = asyncio.get_running_loop().create_task(process.wait())
+    except RuntimeError:
+        # No running loop; the child watcher reaps it when the loop next runs
+        return
+    _REAPERS.add(task)
+    task.add_done_callback(_REAPERS.discard)
+
+
+def _close_stdin(process: asyncio.subprocess.Process) -> bool:
+    """
+    Close a process's stdin, even after its event loop has been closed.
+
+    Args:
+        process: Process whose stdin pipe should be closed
+
+    Returns:
+        False if the loop that owned the pipe is closed, so the process
+        can't be reaped in the background
+    """
+    try:
+        process.stdin.close()
+    except RuntimeError:
+        # The transport can't schedule its cleanup on a closed loop; close
+        # the pipe itself so the shell still sees EOF
+        process.stdin.transport.get_extra_info("pipe").close()
+        return False
+    return True
+
+
+def _wait_pid(pid: int) -> None:
+    """
+    Reap a killed process synchronously.
+
+    Args:
+        pid: Process that has been sent SIGKILL
+    """
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        # Already reaped by the child watcher
+        pass
+
+
+async def drain_reapers() -> None:
+    """
+    Wait until every process terminated by close() has been reaped.
+
+    close() returns without waiting for the process to exit; call this
+    before shutting the event loop down for a deterministic exit.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [task for task in _REAPERS if task.get_loop() is loop]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+@lru_cache(maxsize=8)
+def _resolve_shell(shell_type: str) -> str:
+    """
+    Resolve a shell type to an absolute binary path.
+
+    Cached so repeated shells don't walk PATH and stat every entry.
+
+    Args:
+        shell_type: Shell name (bash, zsh, etc.) or path
+
+    Returns:
+        Absolute path of the shell binary
+    """
+    return shutil.which(shell_type) or f"/bin/{shell_type}"
+
+
+def _simple_argv(
+    command: str, path: Optional[str]
+) -> Optional[Tuple[str, List[str]]]:
+    """
+    Split a command that needs no shell into an executable and argv.
+
+    Args:
+        command: Command to execute
+        path: PATH to look the program up in
+
+    Returns:
+        Tuple of (absolute executable, argv), or None if a shell is needed
+    """
+    if _SHELL_METACHARS.search(command):
+        return None
+
+    # Without quotes or escapes, whitespace splitting is exactly shlex.split
+    argv = command.split()
+    if not argv or argv[0] in _SHELL_BUILTINS:
+        return None
+
+    # A relative path (or a relative PATH entry) would be resolved against
+    # Python's cwd rather than the command's workdir; leave those to the shell
+    if "/" in argv[0] and not os.path.isabs(argv[0]):
+        return None
+    executable = shutil.which(argv[0], path=path)
+    if executable is None or not os.path.isabs(executable):
+        # Let the shell report "command not found" with its usual exit code
+        return None
+    return executable, argv
+
+
+async def _spawn_once(
+    command: str,
+    shell_type: str,
+    env: Dict[str, str],
+    cwd: Optional[str],
+) -> asyncio.subprocess.Process:
+    """
+    Spawn a one-off shell process running a command via posix_spawn.
+
+    CPython's subprocess only takes its os.posix_spawn path (vfork-style, so
+    the parent's page tables are never copied) when the executable is an
+    absolute path, close_fds is False and no cwd is given. The working
+    directory is therefore applied with a leading ``cd``. Descriptors created
+    by Python are non-inheritable (PEP 446), so close_fds=False leaks nothing.
+
+    Args:
+        command: Command to execute
+        shell_type: Shell used to interpret the command
+        env: Environment for the child process
+        cwd: Working directory, or None to inherit
+
+    Returns:
+        The spawned asyncio subprocess
+
+    Raises:
+        FileNotFoundError: If the shell binary does not exist
+    """
+    shell_path = _resolve_shell(shell_type)
+
+    if cwd:
+        command = f"cd -- {shlex.quote(cwd)} || exit 1\n{command}"
+
+    return await asyncio.create_subprocess_exec(
+        shell_path,
+        "-c",
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        close_fds=False,
+    )
+
+
+class _ExecutorProcess:
+    """
+    Stand-in for asyncio.subprocess.Process around a Popen made in a thread.
+
+    Provides the parts the one-off runner uses: pid, returncode, the stdout
+    and stderr stream readers, wait() and kill().
+    """
+
+    def __init__(
+        self,
+        popen: subprocess.Popen,
+        stdout: asyncio.StreamReader,
+        stderr: asyncio.StreamReader,
+    ):
+        """
+        Initialize an _ExecutorProcess.
+
+        Args:
+            popen: The running process
+            stdout: Reader connected to its stdout pipe
+            stderr: Reader connected to its stderr pipe
+        """
+        self._popen = popen
+        self.pid = popen.pid
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def returncode(self) -> Optional[int]:
+        """Exit code, or None while the process is running."""
+        return self._popen.returncode
+
+    def kill(self) -> None:
+        """Kill the process."""
+        if self._popen.returncode is None:
+            try:
+                self._popen.kill()
+            except ProcessLookupError:
+                pass
+
+    async def wait(self) -> int:
+        """
+        Wait for the process to exit without blocking the event loop.
+
+        Returns:
+            The exit code
+        """
+        if self._popen.returncode is not None:
+            return self._popen.returncode
+
+        loop = asyncio.get_running_loop()
+        try:
+            # Readable once the process has exited (Linux 5.3+)
+            pidfd = os.pidfd_open(self._popen.pid)
+        except (AttributeError, OSError):
+            return await loop.run_in_executor(None, self._popen.wait)
+
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+        return self._popen.wait()
+
+
+async def _spawn_in_executor(
+    argv: List[str],
+    executable: str,
+    env: Dict[str, str],
+    cwd: Optional[str],
+) -> _ExecutorProcess:
+    """
+    Create a process in a worker thread and attach its pipes to the loop.
+
+    Popen blocks until the child has exec'd (it reads the exec status from
+    a pipe); doing that in the default executor keeps the event loop free.
+
+    Args:
+        argv: Arguments, with the program name first
+        executable: Absolute path of the program
+        env: Environment for the child process
+        cwd: Working directory, or None to inherit
+
+    Returns:
+        The running process
+    """
+    loop = asyncio.get_running_loop()
+    popen = await loop.run_in_executor(
+        None,
+        lambda: subprocess.Popen(
+            argv,
+            executable=executable,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=cwd,
+            close_fds=False,
+        ),
+    )
+
+    readers = []
+    for pipe in (popen.stdout, popen.stderr):
+        reader = asyncio.StreamReader(loop=loop)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe
+        )
+        readers.append(reader)
+
+    return _ExecutorProcess(popen, *readers)
+
 
 class AgentShell:
     """
@@ -20,6 +417,7 @@ class AgentShell:
 
     Base class that provides:
     - Initialize shell with custom environment and setup
+      (on top of os.environ as it was when the package was imported)
     - Fork new shells inheriting parent state
     - Execute commands with timeout control
     - Basic shell environment and execution state tracking
@@ -41,6 +439,24 @@ class AgentShell:
         self.parent = parent
         self._closed = False
         self._lock = asyncio.Lock()
+        # Long-lived shell process used in persistent mode, started lazily
+        self._process: Optional[asyncio.subprocess.Process] = None
+        # Variables set on our side that the running shell has not seen yet
+        self._pending_exports: Dict[str, str] = {}
+        # Unique per-shell marker prefix; a sequence number per command is
+        # appended, so framing a command costs no fresh randomness
+        self._marker = f"__TINGLY_{uuid.uuid4().hex}_".encode()
+        self._marker_seq = 0
+        # test_command() answers by (command, PATH); forks start from a copy
+        self._probe_cache: Dict[Tuple[str, Optional[str]], bool] = (
+            dict(parent._probe_cache) if parent else {}
+        )
+        # Digest of the last env dump and the _env.version right after it was
+        # parsed; an identical dump is skipped only while _env is untouched
+        self._env_hash: Optional[Tuple[bytes, int]] = None
+        # Flattened copy of the env, valid while _env.version is unchanged
+        self._env_cache: Optional[Dict[str, str]] = None
+        self._env_cache_version = -1
 
         # Initialize hooks - inherit from parent if forking, otherwise use config
         if parent:
@@ -50,12 +466,18 @@ class AgentShell:
             # When creating new shell, use config hooks
             self._hooks = list(self.config.hooks)
 
-        # Initialize environment by inheriting from parent or config
-        self._env = os.environ.copy()
+        # Initialize environment by inheriting from parent or config.
+        # Forked shells get a copy-on-write view of the parent's env, and
+        # root shells layer the config env over the shared os.environ
+        # snapshot, so neither copies the full environment.
+        self._env: _EnvMap
         if parent:
-            self._env.update(parent._env)
+            self._env = parent._fork_env()
+            # Variables given in the fork's config go on top of the parent's
+            if self.config.environment:
+                self._env.update(self.config.environment)
         else:
-            self._env.update(self.config.environment)
+            self._env = _EnvMap(dict(self.config.environment), _SYS_ENV)
 
         # Run setup RC scripts to initialize environment
         # This is done for AgentShell to parse export commands and set up environment
@@ -66,34 +488,99 @@ class AgentShell:
         Run setup RC scripts/commands to initialize the shell.
         This runs synchronously during shell initialization.
 
-        Each pre_script is executed in a subprocess for side effects (file creation,
-        package installation, etc.), and any export commands are parsed to update
-        the parent shell's environment.
+        All pre_scripts are executed in one subprocess for side effects (file
+        creation, package installation, etc.) and each reports its exit code
+        through a marker line. Export commands of the scripts that succeeded are
+        parsed to update the parent shell's environment.
         """
-        import subprocess
+        scripts = self.config.pre_scripts
+        if not scripts:
+            return
 
-        # Run each pre_script sequentially to allow variable expansion between scripts
-        for cmd in self.config.pre_scripts:
-            try:
-                # Execute the command in a subprocess for side effects
-                result = subprocess.run(
-                    cmd,
-                    shell=True,
-                    env=self._env,
-                    cwd=self.config.workdir,
-                    capture_output=True,
-                    text=True,
-                )
+        returncodes, batch_returncode = self._run_batched_pre_scripts(scripts)
+
+        # Parse exports in order to allow variable expansion between scripts
+        for index, cmd in enumerate(scripts):
+            if index < len(returncodes):
+                returncode = returncodes[index]
+            elif index == len(returncodes) and batch_returncode is not None:
+                # This script ended the batch (exit, syntax error, ...); it
+                # has run, and the batch's exit status is its own
+                returncode = batch_returncode
+            else:
+                # An earlier script ended the batch, so run the remaining
+                # ones individually
+                returncode = self._run_single_pre_script(cmd)
+
+            # Parse export commands from the script and update environment
+            # This ensures environment variables are tracked even though
+            # subprocess exports don't persist to the parent
+            if returncode == 0:
+                exported_vars = self._parse_export_command(cmd)
+                self._env.update(exported_vars)
 
-                # Parse export commands from the script and update environment
-                # This ensures environment variables are tracked even though
-                # subprocess exports don't persist to the parent
-                if result.returncode == 0:
-                    exported_vars = self._parse_export_command(cmd)
-                    self._env.update(exported_vars)
-            except Exception:
-                # If a setup script fails, silently continue with the next one
-                pass
+    def _run_batched_pre_scripts(
+        self, scripts: List[str]
+    ) -> Tuple[List[int], Optional[int]]:
+        """
+        Run all pre_scripts in a single subprocess.
+
+        Args:
+            scripts: Setup commands to run in order
+
+        Returns:
+            Tuple of (exit codes of the scripts that reported one, in order;
+            exit status of the batch, or None if it could not be run)
+        """
+        marker = f"__TINGLY_PRE_{uuid.uuid4().hex}__"
+        batch = "".join(
+            f"{cmd}\nprintf '\\n{marker}%d\\n' \"$?\"\n" for cmd in scripts
+        )
+
+        try:
+            result = subprocess.run(
+                batch,
+                shell=True,
+                env=self._env_snapshot(),
+                cwd=self.config.workdir,
+                capture_output=True,
+                text=True,
+                errors="replace",
+            )
+        except Exception:
+            return [], None
+
+        returncodes = [
+            int(line[len(marker):])
+            for line in result.stdout.splitlines()
+            if line.startswith(marker)
+        ]
+        return returncodes, result.returncode
+
+    def _run_single_pre_script(self, cmd: str) -> Optional[int]:
+        """
+        Run one pre_script in its own subprocess.
+
+        Args:
+            cmd: Setup command to run
+
+        Returns:
+            Exit code, or None if the subprocess could not be run
+        """
+        try:
+            result = subprocess.run(
+                cmd,
+                shell=True,
+                env=self._env_snapshot(),
+                cwd=self.config.workdir,
+                capture_output=True,
+                text=True,
+                errors="replace",
+            )
+            return result.returncode
+        except Exception:
+            # If a setup script fails, silently continue with the next one
+            return None
 
     def _parse_export_command(self, command: str) -> Dict[str, str]:
         """
@@ -105,31 +592,170 @@ class AgentShell:
         Returns:
             Dictionary of environment variables extracted from the command
         """
-        import re
-
         env_vars = {}
 
-        # Pattern to match: export VAR="value" or export VAR=value
-        # Also handles: export VAR="value" PATH="new:$PATH"
-        patterns = [
-            r'export\s+(\w+)="([^"]*)"',  # export VAR="value"
-            r"export\s+(\w+)='([^']*)'",  # export VAR='value'
-            r"export\s+(\w+)=([^\s]+?)(?:\s+|$)",  # export VAR=value (no spaces) - non-greedy
-        ]
+        # Cheap substring check first: most commands contain no export at all
+        if "export" not in command:
+            return env_vars
 
-        for pattern in patterns:
-            matches = re.finditer(pattern, command)
-            for match in matches:
-                key = match.group(1)
-                value = match.group(2)
-                # Strip quotes if present
-                value = value.strip('"').strip("'")
-                # Expand variables like $PATH
-                value = self._expand_env_vars(value)
-                env_vars[key] = value
+        # One tokenizing pass: quotes are removed and ; && | ( ) and unquoted
+        # newlines come out as their own tokens, so each simple command can
+        # be told apart
+        lexer = shlex.shlex(
+            command, posix=True, punctuation_chars="".join(_SHELL_PUNCTUATION)
+        )
+        lexer.whitespace = " \t\r"
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            # Unbalanced quotes; fall back to matching the raw text
+            return self._parse_export_command_fallback(command)
+
+        at_command_start = True
+        exporting = False
+        # Nesting depth of a command substitution being skipped
+        depth = 0
+        for index, token in enumerate(tokens):
+            if depth:
+                depth += token.count("(") - token.count(")")
+                if not depth and token.rstrip(")"):
+                    # The substitution's last token also ends the command
+                    at_command_start = True
+                    exporting = False
+                continue
+
+            if token[0] in _SHELL_PUNCTUATION:
+                if token == "(" and exporting and tokens[index - 1].endswith("$"):
+                    # Command substitution inside a value; skip to its end
+                    depth = 1
+                    continue
+                at_command_start = True
+                exporting = False
+                continue
+
+            if at_command_start:
+                name, sep, _ = token.partition("=")
+                if token in _COMMAND_PREFIXES or (sep and name.isidentifier()):
+                    # A keyword or a leading assignment (FOO=1 export ...);
+                    # the command itself comes next
+                    continue
+                exporting = token == "export"
+                at_command_start = False
+                continue
+
+            if not exporting:
+                continue
+
+            key, sep, value = token.partition("=")
+            if not sep or not key.isidentifier():
+                # Options and bare names (export -n VAR, export VAR)
+                continue
+            if value.endswith("$") and tokens[index + 1 : index + 2] == ["("]:
+                # Command substitution; its value can't be predicted
+                continue
+            # Expand variables like $PATH
+            env_vars[key] = self._expand_env_vars(value)
 
         return env_vars
 
+    def _parse_export_command_fallback(self, command: str) -> Dict[str, str]:
+        """
+        Extract export statements with regexes, for commands shlex can't split.
+
+        Args:
+            command: Command string that may contain export statements
+
+        Returns:
+            Dictionary of environment variables extracted from the command
+        """
+        env_vars = {}
+        for match in _EXPORT_FUSED.finditer(command):
+            key, double, single, bare = match.groups()
+            value = next(v for v in (double, single, bare) if v is not None)
+            # Expand variables like $PATH
+            env_vars[key] = self._expand_env_vars(value)
+        return env_vars
+
+    def _track_state_changes(
+        self, command: str, returncode: int, sync_env: bool = True
+    ) -> None:
+        """
+        Predict how a command changed the environment and working directory.
+
+        Exports, unsets, assignments to already-exported variables and a
+        successful cd are mirrored without running anything; commands whose
+        effect can't be read from their text (e.g. source) need refresh_env().
+
+        Args:
+            command: Command that was executed
+            returncode: Exit code of the command
+            sync_env: Whether to track environment changes
+        """
+        if sync_env:
+            exports = self._parse_export_command(command)
+            self._env.update(exports)
+            if self._process is not None and "'" in command:
+                for match in _QUOTED_DOLLAR_EXPORT.finditer(command):
+                    key = match.group(1)
+                    if key in exports:
+                        self._pending_exports[key] = exports[key]
+
+            if "unset" in command:
+                for match in _UNSET_PATTERN.finditer(command):
+                    for key in match.group(1).split():
+                        self._env.discard(key)
+
+            if "=" in command:
+                for match in _ASSIGN_PATTERN.finditer(command):
+                    key = match.group(1)
+                    # Only exported variables are part of the environment
+                    if key in self._env:
+                        value = match.group(2).strip('"').strip("'")
+                        self._env[key] = self._expand_env_vars(value)
+
+        if returncode == 0 and "cd" in command:
+            matches = list(_CD_PATTERN.finditer(command))
+            if matches:
+                self._track_cd(matches[-1].group(1))
+
+    def _track_cd(self, target: Optional[str]) -> None:
+        """
+        Update the working directory after a successful cd.
+
+        Args:
+            target: Argument given to cd, or None for a bare cd
+        """
+        if target is None:
+            target = self._env.get("HOME")
+        elif target == "-" or "`" in target or "$(" in target:
+            # Can't tell where these lead without running them
+            return
+        else:
+            target = self._expand_env_vars(target.strip('"').strip("'"))
+            if target == "~" or target.startswith("~/"):
+                target = self._env.get("HOME", "~") + target[1:]
+        if not target:
+            return
+
+        path = os.path.normpath(
+            os.path.join(self.config.workdir or os.getcwd(), target)
+        )
+        if os.path.isdir(path):
+            self.config.workdir = path
+
+    async def refresh_env(self) -> None:
+        """
+        Read the environment back from the shell.
+
+        execute() tracks environment changes by parsing commands; call this
+        after commands whose effect can't be parsed, such as sourcing a file.
+        In persistent mode this reads the running shell's environment.
+        """
+        if self._closed:
+            raise RuntimeError("Shell is closed")
+        await self._sync_env_from_shell()
+
     def _expand_env_vars(self, value: str) -> str:
         """
         Expand environment variables in a value string.
@@ -140,18 +766,11 @@ class AgentShell:
         Returns:
             String with environment variables expanded
         """
-        import re
-
-        # Replace ${VAR} and $VAR patterns
-        def replace_var(match):
-            var_name = match.group(1)
-            return self._env.get(var_name, match.group(0))
+        if "$" not in value:
+            return value
 
-        # Match both ${VAR} and $VAR
-        pattern = r"\$\{?(\w+)\}?"
-        expanded = re.sub(pattern, replace_var, value)
-
-        return expanded
+        # Replace ${VAR} and $VAR patterns, leaving unknown variables as-is
+        return Template(value).safe_substitute(self._env)
 
     async def _sync_env_from_shell(self) -> None:
         """
@@ -159,52 +778,54 @@ class AgentShell:
         This captures exported environment variables.
 
         Tries multiple methods in order for maximum portability:
-        1. 'env' command (available on most Unix-like systems)
-        2. 'printenv' command (Unix systems, not on Windows)
+        1. 'env -0' command (NUL-delimited, unambiguous for multi-line values)
+        2. 'printenv' command (newline-delimited fallback)
         3. Falls back to no sync if neither is available
         """
-        # Try 'env' first (more portable than printenv)
-        if await self._try_sync_with_command("env"):
+        # Try 'env -0' first (GNU and BSD env both support it)
+        if await self._try_sync_with_command("env -0", "\0"):
             return
 
-        # Fall back to 'printenv' if 'env' is not available
-        if await self._try_sync_with_command("printenv"):
+        # Fall back to 'printenv' if 'env -0' is not available
+        if await self._try_sync_with_command("printenv", "\n"):
             return
 
         # If neither command is available, silently skip sync
         # The shell will continue to use its internal _env tracking
         pass
 
-    async def _try_sync_with_command(self, command: str) -> bool:
+    async def _try_sync_with_command(self, command: str, separator: str) -> bool:
         """
         Attempt to sync environment using a specific command.
 
         Args:
-            command: The command to use for syncing ('env', 'printenv', etc.)
+            command: The command to use for syncing ('env -0', 'printenv', etc.)
+            separator: Character separating KEY=VALUE entries in the output
 
         Returns:
             True if sync succeeded, False if command not available or failed
         """
         try:
-            # Run the command to get all environment variables
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=self._env,
-                cwd=self.config.workdir,
-            )
-            stdout, _ = await process.communicate()
-
-            if process.returncode == 0:
+            # Run the command to get all environment variables; in persistent
+            # mode this reads the live shell's environment
+            returncode, stdout, _ = await self._run_command(command, None)
+
+            if returncode == 0:
+                # Most commands leave the environment untouched; skip the
+                # parse entirely when the dump is byte-identical to the last one
+                # and nothing (e.g. predictive tracking) has written _env since
+                digest = hashlib.blake2b(stdout, digest_size=8).digest()
+                if self._env_hash == (digest, self._env.version):
+                    return True
+
+                # Parse command output (KEY=VALUE per entry): one decode of
+                # the whole dump, then C-level split/partition per entry
                 output = stdout.decode("utf-8")
-                # Parse command output (KEY=VALUE per line)
-                for line in output.splitlines():
-                    if "=" in line:
-                        key, value = line.split("=", 1)
-                        # Only update if the value is different
-                        if self._env.get(key) != value:
-                            self._env[key] = value
+                for entry in output.split(separator):
+                    key, sep, value = entry.partition("=")
+                    if sep:
+                        self._env[key] = value
+                self._env_hash = (digest, self._env.version)
                 return True
             return False
         except Exception:
@@ -218,18 +839,17 @@ class AgentShell:
         Args:
             export_output: Output from 'export -p' command
         """
-        import re
-
         # Parse lines like: declare -x VAR="value"
         # or: export VAR="value"
-        pattern = r'declare\s+-x\s+(\w+)="([^"]*)"|export\s+(\w+)="([^"]*)"'
-
         for line in export_output.splitlines():
-            match = re.search(pattern, line)
+            match = _DECLARE_X.search(line)
             if match:
-                # Handle both patterns
-                key = match.group(1) if match.group(1) else match.group(3)
-                value = match.group(2) if match.group(2) else match.group(4)
+                # Handle both patterns; pick the value by which key matched,
+                # since an empty value is falsy
+                if match.group(1):
+                    key, value = match.group(1), match.group(2)
+                else:
+                    key, value = match.group(3), match.group(4)
 
                 # Update environment
                 self._env[key] = value
@@ -269,16 +889,23 @@ class AgentShell:
         command: str,
         timeout: Optional[float] = None,
         check: bool = False,
-        sync_env: bool = True,
+        sync_env: Optional[bool] = None,
     ) -> "ExecuteResult":
         """
-        Execute a command in the shell using a one-off subprocess.
+        Execute a command in the shell.
+
+        In persistent mode (the default) commands run one after another in a
+        long-lived shell process, so state like the working directory carries
+        over between them; otherwise each command gets a one-off subprocess.
 
         Args:
             command: Command to execute
             timeout: Timeout in seconds (None for no timeout)
             check: If True, raise exception on non-zero exit code
-            sync_env: If True, sync environment variables after execution
+            sync_env: If True, track environment changes made by the command
+                (export, unset, assignments). None (default) tracks only when
+                the command looks env-mutating; use refresh_env() to read
+                the environment back from the shell
 
         Returns:
             ExecuteResult with command output and metadata
@@ -293,87 +920,67 @@ class AgentShell:
         if self._closed:
             raise RuntimeError("Shell is closed")
 
+        # A literal export only changes our env; skip the subprocess entirely
+        if sync_env is not False and not self._hooks:
+            result = self._try_literal_export(command)
+            if result is not None:
+                return result
+
         # Store original command for hooks
         original_command = command
-
-        # Create execution context for hooks
-        execution_context = {
-            "timeout": timeout,
-            "sync_env": sync_env,
-            "timestamp": time.time(),
-        }
-
-        # Apply pre-execute hooks to get wrapped command
-        wrapped_command = await self._apply_hooks(
-            original_command, context=execution_context
-        )
+        sync_env = self._should_sync_env(original_command, sync_env)
+
+        # Without hooks, skip building the context and both hook passes
+        hooks = self._hooks
+        wrapped_command = original_command
+        if hooks:
+            # Create execution context for hooks
+            execution_context = {
+                "timeout": timeout,
+                "sync_env": sync_env,
+                "timestamp": time.time(),
+            }
+
+            # Apply pre-execute hooks to get wrapped command
+            wrapped_command = await self._apply_hooks(
+                original_command, context=execution_context
+            )
 
         # Record start time
         start_time = time.time()
 
         try:
-            # Use one-off subprocess for execution
-            process = await asyncio.create_subprocess_shell(
-                wrapped_command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=self._env,
-                cwd=self.config.workdir,
+            returncode, stdout, stderr = await self._run_command(
+                wrapped_command, timeout
             )
 
-            try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
-                    timeout=timeout,
-                )
-            except asyncio.TimeoutError:
-                process.kill()
-                try:
-                    await process.wait()
-                except Exception:
-                    pass
-                # Re-raise TimeoutError without wrapping it
-                raise
-
             execution_time = time.time() - start_time
 
             result = ExecuteResult(
                 command=wrapped_command,
-                returncode=process.returncode,
-                stdout=stdout.decode("utf-8"),
-                stderr=stderr.decode("utf-8"),
+                returncode=returncode,
+                stdout_bytes=stdout,
+                stderr_bytes=stderr,
                 execution_time=execution_time,
             )
 
-            # Parse and update environment BEFORE execution (predictive approach)
-            # This updates _env based on commands that will affect environment
+            # Update env and workdir predictively from the command itself
             # Use original command to parse exports, not wrapped command
-            if sync_env:
-                exported_vars = self._parse_export_command(original_command)
-                self._env.update(exported_vars)
+            self._track_state_changes(original_command, returncode, sync_env)
 
-            # Sync environment variables from the shell AFTER execution
-            # This gets the actual state from the subprocess
-            if sync_env and process.returncode == 0:
-                await self._sync_env_from_shell()
-
-            if check and process.returncode != 0:
+            if check and returncode != 0:
                 raise subprocess.CalledProcessError(
-                    process.returncode,
+                    returncode,
                     command,
                     output=stdout,
                     stderr=stderr,
                 )
 
-            # Parse and update environment
-            if sync_env:
-                exported_vars = self._parse_export_command(original_command)
-                self._env.update(exported_vars)
-
             # Apply post-execute hooks to process result
-            result = await self._apply_hooks(
-                original_command, result, execution_context
-            )
+            if hooks:
+                result = await self._apply_hooks(
+                    original_command, result, execution_context
+                )
 
             return result
 
@@ -384,6 +991,352 @@ class AgentShell:
             execution_time = time.time() - start_time
             raise RuntimeError(f"Failed to execute command '{command}': {e}") from e
 
+    def _try_literal_export(self, command: str) -> Optional[ExecuteResult]:
+        """
+        Apply a command that only exports a literal value, without a shell.
+
+        Args:
+            command: Command to execute
+
+        Returns:
+            ExecuteResult for the export, or None if the command needs a shell
+        """
+        match = _LITERAL_EXPORT.fullmatch(command)
+        if match is None:
+            return None
+
+        key = match.group(1)
+        value = next((v for v in match.group(2, 3, 4) if v is not None), "")
+        self._env[key] = value
+        if self._process is not None:
+            self._pending_exports[key] = value
+
+        return ExecuteResult(
+            command=command,
+            returncode=0,
+            stdout_bytes=b"",
+            stderr_bytes=b"",
+            execution_time=0.0,
+        )
+
+    def _should_sync_env(self, command: str, sync_env: Optional[bool]) -> bool:
+        """
+        Resolve whether a command needs an environment sync.
+
+        Args:
+            command: Command as submitted by the caller
+            sync_env: Explicit choice, or None to decide from the command
+
+        Returns:
+            True if the environment should be synced after execution
+        """
+        if sync_env is None:
+            # Commands like echo or pwd cannot change the environment,
+            # so skip the extra sync roundtrip for them
+            return _ENV_MUTATING.search(command) is not None
+        return sync_env
+
+    async def _run_command(
+        self, command: str, timeout: Optional[float]
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command the way the config asks for.
+
+        Args:
+            command: Command to execute
+            timeout: Timeout in seconds (None for no timeout)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+        """
+        if self.config.multiplex:
+            # Let the shared bash daemon fork the command
+            return await BashDaemon.get().run(
+                command,
+                self._env_snapshot(),
+                self.config.workdir,
+                timeout,
+                self.config.max_output_bytes,
+            )
+        if self.config.pooled:
+            # Hand the command to a pre-started shell
+            return await ShellPool.get().run(
+                command,
+                self._env_snapshot(),
+                self.config.workdir,
+                timeout,
+                self.config.max_output_bytes,
+            )
+        if self.config.persistent:
+            return await self._run_persistent(command, timeout)
+        # Use one-off subprocess for execution
+        return await self._run_oneoff(command, timeout)
+
+    async def _start_process(self) -> asyncio.subprocess.Process:
+        """
+        Start the persistent shell process if it is not running.
+
+        Returns:
+            The running shell process
+        """
+        if self._process is None:
+            try:
+                # Own session, so a timed-out command can be killed with its children
+                self._process = await asyncio.create_subprocess_exec(
+                    _resolve_shell(self.config.shell_type),
+                    "-s",
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=self._env_snapshot(),
+                    cwd=self.config.workdir,
+                    start_new_session=True,
+                )
+            except Exception as e:
+                raise RuntimeError(f"Failed to start persistent shell process: {e}") from e
+            # A new process starts with the whole environment already
+            self._pending_exports.clear()
+
+        return self._process
+
+    async def _run_persistent(
+        self, command: str, timeout: Optional[float]
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in the persistent shell process.
+
+        The command is evaluated with stdin detached, then a unique marker
+        carrying its exit code is printed to stdout and the same marker to
+        stderr, so both streams can be read to the end of the command's output.
+        A command that ends the shell (e.g. ``exit 3``) reports the shell's
+        exit code, and the next command starts a new shell. A shell that died
+        between commands is replaced and the command sent once more.
+
+        Args:
+            command: Command to execute
+            timeout: Timeout in seconds (None for no timeout)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+
+        Raises:
+            asyncio.TimeoutError: If command times out
+            BrokenPipeError, ConnectionResetError: If the new shell dies too
+        """
+        async with self._lock:
+            self._marker_seq += 1
+            marker = self._marker + b"%d:" % self._marker_seq
+            limit = self.config.max_output_bytes
+            trailer = (
+                f"eval {shlex.quote(command)} </dev/null\n"
+                f"printf '%s%d\\n' '{marker.decode()}' \"$?\"\n"
+                f"printf '%s' '{marker.decode()}' >&2\n"
+            )
+
+            for attempt in range(2):
+                process = await self._start_process()
+                prelude = "".join(
+                    f"export {key}={shlex.quote(value)}\n"
+                    for key, value in self._pending_exports.items()
+                    if IDENTIFIER.match(key)
+                )
+                try:
+                    process.stdin.write(f"{prelude}{trailer}".encode())
+                    await process.stdin.drain()
+                    break
+                except (BrokenPipeError, ConnectionResetError):
+                    if attempt:
+                        raise
+                    # The shell died between commands, so the command never
+                    # reached it; send it once more to a fresh shell
+                    await self._kill_process()
+            self._pending_exports.clear()
+
+            try:
+                # Drain both pipes together so a chatty stderr can't block stdout
+                stdout, stderr = await asyncio.wait_for(
+                    asyncio.gather(
+                        read_until(process.stdout, marker, b"\n", limit),
+                        read_until(process.stderr, marker, limit=limit),
+                    ),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                # Kill the command along with the shell; the next one respawns
+                await self._kill_process()
+                raise
+
+            output, found, status = stdout.rpartition(marker)
+            if not found:
+                # The command ended the shell itself
+                returncode = await self._kill_process()
+                return returncode, tail(stdout, limit), tail(stderr, limit)
+
+            stderr = stderr[: -len(marker)]
+            return int(status), tail(output, limit), tail(stderr, limit)
+
+    async def _kill_process(self) -> Optional[int]:
+        """
+        Kill the persistent shell process and everything it started.
+
+        Returns:
+            Exit code of the shell, or None if none was running
+        """
+        process, self._process = self._process, None
+        if process is None:
+            return None
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        return await process.wait()
+
+    async def _run_oneoff(
+        self, command: str, timeout: Optional[float]
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in a one-off subprocess.
+
+        Args:
+            command: Command to execute
+            timeout: Timeout in seconds (None for no timeout)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+
+        Raises:
+            asyncio.TimeoutError: If command times out
+        """
+        process = await self._spawn_process(command)
+        limit = self.config.max_output_bytes
+
+        try:
+            # Cancelled as a whole on timeout, before the process is killed
+            stdout, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(
+                    read_capped(process.stdout, limit),
+                    read_capped(process.stderr, limit),
+                    process.wait(),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            try:
+                await process.wait()
+            except Exception:
+                pass
+            # Re-raise TimeoutError without wrapping it
+            raise
+
+        return process.returncode, stdout, stderr
+
+    async def _spawn_process(self, command: str) -> asyncio.subprocess.Process:
+        """
+        Spawn a one-off process for a command.
+
+        A command that needs no shell features is executed directly, saving
+        the intermediate shell process. Otherwise posix_spawn is preferred
+        when enabled in the config, falling back to a regular shell
+        subprocess if the spawn fails. With spawn_in_executor set, the
+        process is created in a worker thread instead of on the event loop.
+
+        Args:
+            command: Command to execute
+
+        Returns:
+            The spawned asyncio subprocess
+        """
+        env = self._env_snapshot()
+
+        simple = _simple_argv(command, env.get("PATH", os.defpath))
+        if self.config.spawn_in_executor:
+            if simple is not None:
+                executable, argv = simple
+            else:
+                executable = _resolve_shell(self.config.shell_type)
+                argv = [executable, "-c", command]
+            try:
+                return await _spawn_in_executor(
+                    argv, executable, env, self.config.workdir
+                )
+            except OSError:
+                # Fall through to the asyncio spawners below
+                pass
+
+        if simple is not None:
+            executable, argv = simple
+            try:
+                return await asyncio.create_subprocess_exec(
+                    *argv,
+                    executable=executable,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=env,
+                    cwd=self.config.workdir,
+                    close_fds=False,
+                )
+            except OSError:
+                # Not executable after all; let the shell handle it
+                pass
+
+        if self.config.use_posix_spawn:
+            try:
+                return await _spawn_once(
+                    command,
+                    self.config.shell_type,
+                    env,
+                    self.config.workdir,
+                )
+            except OSError:
+                # Shell binary missing or spawn refused, use the fallback
+                pass
+
+        return await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            cwd=self.config.workdir,
+        )
+
+    def _env_snapshot(self) -> Dict[str, str]:
+        """
+        Get the flattened environment, rebuilt only after it changed.
+
+        Returns:
+            Cached environment dictionary; callers must not modify it
+        """
+        if self._env_cache_version != self._env.version or self._env_cache is None:
+            self._env_cache = dict(self._env)
+            self._env_cache_version = self._env.version
+        return self._env_cache
+
+    def _fork_env(self) -> "_EnvMap":
+        """
+        Create a copy-on-write environment for a forked child.
+
+        The current layers are frozen and shared with the child; from then on
+        both shells write into a fresh front layer of their own, so neither
+        sees the other's later changes.
+
+        Returns:
+            Environment mapping for the child shell
+        """
+        maps = self._env.maps
+        if len(maps) >= _MAX_ENV_LAYERS:
+            # Keep lookups cheap after many forks by flattening the layers
+            maps[:] = [self._env_snapshot().copy()]
+
+        if maps[0]:
+            shared = list(maps)
+            maps.insert(0, {})
+        else:
+            # Front layer is still empty, so it can stay private to this shell
+            shared = maps[1:]
+
+        return _EnvMap({}, *shared)
+
     def fork(self, config: Optional["ShellConfig"] = None) -> "AgentShell":
         """
         Fork a new shell inheriting this shell's environment.
@@ -397,11 +1350,9 @@ class AgentShell:
         if self._closed:
             raise RuntimeError("Cannot fork from closed shell")
 
+        # The environment itself is inherited copy-on-write (see _fork_env),
+        # so the child's config only carries variables it adds on top
         if config:
-            # Merge inherited env with new config env
-            merged_env = self._env.copy()
-            merged_env.update(config.environment)
-            config.environment = merged_env
             # Inherit shell type and other settings
             if not config.shell_type:
                 config.shell_type = self.config.shell_type
@@ -415,7 +1366,6 @@ class AgentShell:
             # Create config inheriting all from parent
             config = ShellConfig(
                 shell_type=self.config.shell_type,
-                environment=self._env.copy(),
                 pre_scripts=self.config.pre_scripts.copy(),
                 workdir=self.config.workdir,
                 hooks=list(self.config.hooks),
@@ -434,6 +1384,8 @@ class AgentShell:
         if self._closed:
             raise RuntimeError("Shell is closed")
         self._env[key] = value
+        if self._process is not None:
+            self._pending_exports[key] = value
 
     def getenv(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """
@@ -455,7 +1407,7 @@ class AgentShell:
         Returns:
             Dictionary of all environment variables
         """
-        return self._env.copy()
+        return self._env_snapshot().copy()
 
     def get_config(self) -> "ShellConfig":
         """
@@ -481,17 +1433,23 @@ class AgentShell:
         Returns:
             ExecuteResult with command output and metadata
         """
-        if not os.path.exists(script_path):
-            raise FileNotFoundError(f"Script not found: {script_path}")
+        try:
+            mode = os.stat(script_path).st_mode
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Script not found: {script_path}") from None
 
         if not os.access(script_path, os.R_OK):
             raise PermissionError(f"Cannot read script: {script_path}")
 
-        # Make script executable
-        os.chmod(script_path, 0o755)
+        # Make script executable, unless it already is for everyone
+        if mode & 0o111 != 0o111:
+            os.chmod(script_path, stat.S_IMODE(mode) | 0o755)
 
-        # Execute the script
-        return await self.execute(f"'{script_path}'", timeout=timeout)
+        # Execute the script by the absolute path checked above, so it does
+        # not depend on the shell's workdir; a path with no special
+        # characters stays unquoted and can be exec'd without a shell
+        command = shlex.quote(os.path.abspath(script_path))
+        return await self.execute(command, timeout=timeout)
 
     async def test_command(self, command: str) -> bool:
         """
@@ -503,12 +1461,29 @@ class AgentShell:
         Returns:
             True if command is available, False otherwise
         """
+        # Keyed by PATH too, so any change to it invalidates earlier answers
+        key = (command, self._env.get("PATH"))
+        cached = self._probe_cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
             result = await self.execute(f"command -v {command}", timeout=5.0)
-            return result.returncode == 0
         except Exception:
             return False
 
+        available = self._probe_cache[key] = result.returncode == 0
+        return available
+
+    def clear_cache(self) -> None:
+        """
+        Forget cached test_command() results.
+
+        Needed only when availability changes without PATH changing, e.g.
+        after installing a program or defining a shell function.
+        """
+        self._probe_cache.clear()
+
     def is_alive(self) -> bool:
         """
         Check if the shell is alive (not closed).
@@ -523,19 +1498,42 @@ class AgentShell:
         Close the shell and clean up resources (synchronous).
         """
         self._closed = True
-        # Note: For full cleanup of persistent processes, use async_close()
-        # or use the async context manager
+
+        # Don't wait for the shell to exit; it is reaped in the background
+        process, self._process = self._process, None
+        if process is not None:
+            loop_open = _close_stdin(process)
+            try:
+                # Without a loop to reap it later, make sure it exits now
+                os.killpg(process.pid, signal.SIGTERM if loop_open else signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            if loop_open:
+                _reap(process)
+            else:
+                _wait_pid(process.pid)
 
     async def async_close(self) -> None:
         """
         Asynchronously close the shell and clean up resources.
 
-        For AgentShell, this just marks the shell as closed since there's
-        no persistent process to clean up. Subclasses like SessionShell
-        override this to clean up their persistent processes.
+        Asks the persistent shell process, if any, to exit and waits for it,
+        killing it if it does not exit in time.
         """
         self._closed = True
 
+        async with self._lock:
+            process = self._process
+            if process is None:
+                return
+            try:
+                process.stdin.write(b"exit\n")
+                await process.stdin.drain()
+                await asyncio.wait_for(process.wait(), timeout=2.0)
+                self._process = None
+            except Exception:
+                await self._kill_process()
+
     async def __aenter__(self):
         """Async context manager entry."""
         return self
@@ -0,0 +1,362 @@
+"""
+Shared bash processes: BashDaemon, which forks one-off commands for many
+shells, and ShellPool, which keeps pre-started shells for one-off commands.
+"""
+
+import asyncio
+import os
+import shlex
+import uuid
+import weakref
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from .process_io import env_prelude, killpg, read_capped, read_until, tail
+
+
+class BashDaemon:
+    """
+    Long-lived bash process that forks one-off commands on behalf of shells.
+
+    Forking a small bash is much cheaper than forking the (far larger) Python
+    process, so shells created with ``ShellConfig(multiplex=True)`` send their
+    commands here instead of spawning a subprocess each. Every command runs in
+    a subshell with the caller's working directory and environment applied, so
+    commands keep the isolation of a one-off subprocess.
+
+    Commands are multiplexed over the daemon's stdin and framed with unique
+    markers; they run one at a time. There is one daemon per event loop, see
+    ``BashDaemon.get()``. Call ``close()`` before the loop is shut down.
+    """
+
+    _instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BashDaemon]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(self):
+        """Initialize a BashDaemon; the bash process starts on first use."""
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._base_env: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        # Unique marker prefix plus a per-command sequence number
+        self._marker = f"__TINGLY_DAEMON_{uuid.uuid4().hex}_".encode()
+        self._marker_seq = 0
+
+    @classmethod
+    def get(cls) -> "BashDaemon":
+        """
+        Get the daemon for the running event loop, creating it if needed.
+
+        Returns:
+            BashDaemon instance
+        """
+        loop = asyncio.get_running_loop()
+        daemon = cls._instances.get(loop)
+        if daemon is None:
+            daemon = cls._instances[loop] = cls()
+        return daemon
+
+    async def _start(self) -> None:
+        """Start the bash process if it is not running."""
+        if self._process is not None:
+            return
+
+        self._base_env = dict(os.environ)
+        try:
+            # Own session, so a timed-out command can be killed with its children
+            self._process = await asyncio.create_subprocess_exec(
+                "bash",
+                "-s",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._base_env,
+                start_new_session=True,
+            )
+        except Exception as e:
+            raise RuntimeError(f"Failed to start bash daemon: {e}") from e
+
+    async def run(
+        self,
+        command: str,
+        env: Mapping[str, str],
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in a subshell of the daemon.
+
+        Args:
+            command: Command to execute
+            env: Environment for the command
+            cwd: Working directory, or None for the current one
+            timeout: Timeout in seconds (None for no timeout)
+            limit: Output bytes to keep per stream (None keeps everything)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+
+        Raises:
+            asyncio.TimeoutError: If command times out, counting the time
+                spent waiting for commands queued before it
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # Commands run one at a time, so the deadline has to cover the wait
+        # for the daemon too, or a short timeout could wait out a long command
+        await asyncio.wait_for(self._lock.acquire(), timeout)
+        try:
+            if timeout is not None:
+                timeout = max(0.0, timeout - (loop.time() - start))
+            return await self._run_locked(command, env, cwd, timeout, limit)
+        finally:
+            self._lock.release()
+
+    async def _run_locked(
+        self,
+        command: str,
+        env: Mapping[str, str],
+        cwd: Optional[str],
+        timeout: Optional[float],
+        limit: Optional[int],
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in a subshell of the daemon, holding the lock.
+
+        Args:
+            command: Command to execute
+            env: Environment for the command
+            cwd: Working directory, or None for the current one
+            timeout: Time left before the deadline (None for no timeout)
+            limit: Output bytes to keep per stream (None keeps everything)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+        """
+        await self._start()
+        process = self._process
+
+        self._marker_seq += 1
+        marker = self._marker + b"%d:" % self._marker_seq
+        # The daemon keeps the cwd it started in; follow the caller's
+        chdir = f"cd -- {shlex.quote(cwd or os.getcwd())} || exit 1\n"
+        # eval keeps syntax errors inside the subshell, and stdin is
+        # detached so the command cannot swallow the framing lines
+        script = (
+            f"(\n{env_prelude(self._base_env, env)}\n{chdir}"
+            f"eval {shlex.quote(command)}\n) </dev/null\n"
+            f"printf '%s%d\\n' '{marker.decode()}' \"$?\"\n"
+            f"printf '%s' '{marker.decode()}' >&2\n"
+        )
+
+        try:
+            process.stdin.write(script.encode())
+            await process.stdin.drain()
+
+            # Drain both pipes together so a chatty stderr can't block stdout
+            stdout, stderr = await asyncio.wait_for(
+                asyncio.gather(
+                    read_until(process.stdout, marker, b"\n", limit),
+                    read_until(process.stderr, marker, limit=limit),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            # The subshell may still be writing; restart the daemon cleanly
+            await self._kill()
+            raise
+        except Exception as e:
+            await self._kill()
+            raise RuntimeError(f"Bash daemon failed: {e}") from e
+
+        output, found, status = stdout.rpartition(marker)
+        if not found:
+            await self._kill()
+            raise RuntimeError("Bash daemon exited unexpectedly")
+        return int(status), tail(output, limit), tail(stderr[: -len(marker)], limit)
+
+    async def _kill(self) -> None:
+        """Kill the bash process and everything it started."""
+        process, self._process = self._process, None
+        if process is not None:
+            await killpg(process)
+
+    async def close(self) -> None:
+        """Stop the bash process."""
+        async with self._lock:
+            process, self._process = self._process, None
+            if process is None:
+                return
+            try:
+                process.stdin.write(b"exit\n")
+                await process.stdin.drain()
+                await asyncio.wait_for(process.wait(), timeout=2.0)
+            except Exception:
+                self._process = process
+                await self._kill()
+
+
+class ShellPool:
+    """
+    Pool of started, idle bash processes for one-off commands.
+
+    Shells created with ``ShellConfig(pooled=True)`` give each command to
+    an idle ``bash -s`` that was started ahead of time, so the fork+exec is
+    off the command's critical path. The command is written to the shell's
+    stdin, which is then closed: the shell runs it and exits with its status,
+    exactly like a one-off subprocess. The pool refills in the background.
+    There is one pool per event loop, see ``ShellPool.get()``. The pool
+    closes itself when ``asyncio.run()`` shuts its loop down; with a loop
+    managed by hand, call ``close()`` before the loop is closed.
+    """
+
+    _instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ShellPool]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(self, size: Optional[int] = None):
+        """
+        Initialize a ShellPool; shells are started on first use.
+
+        Args:
+            size: Idle shells to keep (defaults to the CPU count, at most 4)
+        """
+        self.size = size or min(4, os.cpu_count() or 1)
+        self._idle: List[asyncio.subprocess.Process] = []
+        self._refill_task: Optional[asyncio.Task] = None
+        self._shutdown_task: Optional[asyncio.Task] = None
+        self._base_env: Dict[str, str] = dict(os.environ)
+
+    @classmethod
+    def get(cls) -> "ShellPool":
+        """
+        Get the pool for the running event loop, creating it if needed.
+
+        Returns:
+            ShellPool instance
+        """
+        loop = asyncio.get_running_loop()
+        pool = cls._instances.get(loop)
+        if pool is None:
+            pool = cls._instances[loop] = cls()
+            pool._shutdown_task = loop.create_task(pool._close_on_shutdown())
+        return pool
+
+    async def _close_on_shutdown(self) -> None:
+        """
+        Wait for the loop to shut down, then close the pool.
+
+        asyncio.run() cancels the tasks still pending before it closes the
+        loop, so idle shells don't outlive the loop they were started on.
+        """
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await self.close()
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        """Start an idle shell waiting for its command on stdin."""
+        # Own session, so a timed-out command can be killed with its children
+        return await asyncio.create_subprocess_exec(
+            "bash",
+            "-s",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=self._base_env,
+            start_new_session=True,
+        )
+
+    async def _refill(self) -> None:
+        """Start shells until the pool is full again."""
+        while len(self._idle) < self.size:
+            self._idle.append(await self._spawn())
+
+    async def _acquire(self) -> asyncio.subprocess.Process:
+        """Take an idle shell, starting one if the pool is empty."""
+        process = None
+        while self._idle:
+            candidate = self._idle.pop()
+            if candidate.returncode is None:
+                process = candidate
+                break
+
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+        if process is None:
+            try:
+                process = await self._spawn()
+            except Exception as e:
+                raise RuntimeError(f"Failed to start pooled shell: {e}") from e
+        return process
+
+    async def run(
+        self,
+        command: str,
+        env: Mapping[str, str],
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in one of the pool's shells.
+
+        Args:
+            command: Command to execute
+            env: Environment for the command
+            cwd: Working directory, or None for the current one
+            timeout: Timeout in seconds (None for no timeout)
+            limit: Output bytes to keep per stream (None keeps everything)
+
+        Returns:
+            Tuple of (returncode, stdout, stderr)
+
+        Raises:
+            asyncio.TimeoutError: If command times out
+        """
+        process = await self._acquire()
+
+        # Pooled shells keep the cwd they were started in; follow the caller's
+        chdir = f"cd -- {shlex.quote(cwd or os.getcwd())} || exit 1\n"
+        # eval keeps a syntax error from stopping the shell before it runs
+        script = (
+            f"{env_prelude(self._base_env, env)}\n{chdir}"
+            f"eval {shlex.quote(command)} </dev/null\n"
+        )
+
+        try:
+            process.stdin.write(script.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+
+            stdout, stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(
+                    read_capped(process.stdout, limit),
+                    read_capped(process.stderr, limit),
+                    process.wait(),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            await killpg(process)
+            raise
+        except Exception as e:
+            await killpg(process)
+            raise RuntimeError(f"Pooled shell failed: {e}") from e
+
+        return returncode, stdout, stderr
+
+    async def close(self) -> None:
+        """Stop the idle shells and the refill."""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._refill_task = None
+
+        idle, self._idle = self._idle, []
+        for process in idle:
+            await killpg(process)
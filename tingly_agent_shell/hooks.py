@@ -2,10 +2,18 @@
 Command Hook System - Extensible framework for command pre/post processing.
 """
 
-import uuid
+import hashlib
+import os
+import re
+import time
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Optional, Callable
 
+from .types import ExecuteResult
+
+# Line boundaries str.splitlines recognizes besides "\n"
+_OTHER_LINE_BREAK = re.compile("[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
 
 class CommandHook(ABC):
     """
@@ -85,6 +93,9 @@ class EchoMarkerHook(CommandHook):
         self.include_timestamp = include_timestamp
         self.include_command_hash = include_command_hash
         self._execution_counter = 0
+        # Random bytes for execution ids, fetched in bulk and consumed 4 at a time
+        self._rand_buf = b""
+        self._rand_pos = 0
 
     def _default_marker_format(self, execution_id: str, event: str) -> str:
         """
@@ -101,25 +112,24 @@ class EchoMarkerHook(CommandHook):
         parts.append(execution_id)
 
         if self.include_timestamp:
-            import time
             parts.append(f"TS_{int(time.time())}")
 
-        if self.include_command_hash:
-            import hashlib
-            # Short hash will be added later
-
         return "_".join(parts)
 
     def _generate_execution_id(self) -> str:
         """Generate unique execution ID."""
         self._execution_counter += 1
-        # Combine counter with UUID for uniqueness
-        return f"{self._execution_counter}_{uuid.uuid4().hex[:8]}"
+        if self._rand_pos >= len(self._rand_buf):
+            self._rand_buf = os.urandom(4096)
+            self._rand_pos = 0
+        tag = self._rand_buf[self._rand_pos:self._rand_pos + 4].hex()
+        self._rand_pos += 4
+        # Combine counter with random tag for uniqueness
+        return f"{self._execution_counter}_{tag}"
 
     def _hash_command(self, command: str) -> str:
         """Generate short hash of command."""
-        import hashlib
-        return hashlib.md5(command.encode()).hexdigest()[:8]
+        return hashlib.blake2b(command.encode(), digest_size=4).hexdigest()
 
     async def pre_execute(self, command: str, context: Dict[str, Any]) -> str:
         """
@@ -142,10 +152,9 @@ class EchoMarkerHook(CommandHook):
         context['_echo_marker_id'] = execution_id
         context['_echo_marker_hash'] = command_hash
         context['_command_hash'] = command_hash
-
-        # Generate marker text
-        start_marker = self.marker_format(execution_id, 'start')
-        end_marker = self.marker_format(execution_id, 'end')
+        # Marker strings for CommandValidator, built once per execution
+        context['_echo_marker_start_str'] = f"CMD_MARKER_START_{execution_id}"
+        context['_echo_marker_end_str'] = f"CMD_MARKER_END_{execution_id}"
 
         # Wrap command with both start and end markers
         # Format: echo "=== START ===" && command && echo "=== END ==="
@@ -186,18 +195,13 @@ class EchoMarkerHook(CommandHook):
             cleaned_stdout = self._clean_markers(result.stdout, execution_id, command_hash)
 
             # Create new result with cleaned output
-            # Note: We need to handle this dynamically since ExecuteResult is in types module
-            result_dict = {
-                'command': original,
-                'returncode': result.returncode,
-                'stdout': cleaned_stdout,
-                'stderr': result.stderr,
-                'execution_time': result.execution_time,
-            }
-
-            # Import ExecuteResult dynamically to avoid circular imports
-            from tingly_agent_shell.types import ExecuteResult
-            cleaned_result = ExecuteResult(**result_dict)
+            cleaned_result = ExecuteResult(
+                command=original,
+                returncode=result.returncode,
+                stdout_bytes=cleaned_stdout.encode("utf-8"),
+                stderr_bytes=result.stderr_bytes,
+                execution_time=result.execution_time,
+            )
 
             return cleaned_result
 
@@ -220,25 +224,31 @@ class EchoMarkerHook(CommandHook):
         Returns:
             Output with markers removed
         """
-        lines = output.splitlines()
-        cleaned_lines = []
-
-        for line in lines:
-            # Skip lines that contain our markers
-            # Match both "CMD_MARKER_START_id" and "CMD_MARKER_END_id"
-            if f"CMD_MARKER_START_{execution_id}" in line:
-                continue
-            if f"CMD_MARKER_END_{execution_id}" in line:
-                continue
-            # Also skip the formatted echo lines
-            if f"=== CMD_MARKER_START_{execution_id} ===" in line:
-                continue
-            if f"=== CMD_MARKER_END_{execution_id} ===" in line:
-                continue
-
-            cleaned_lines.append(line)
-
-        return "\n".join(cleaned_lines)
+        # Pattern starts with a literal, so the regex engine jumps between
+        # candidates with a fast scan instead of trying every line start
+        pattern = re.compile(rf"CMD_MARKER_(?:START|END)_{re.escape(execution_id)}")
+
+        if _OTHER_LINE_BREAK.search(output):
+            # Rare: line breaks other than "\n" ("\r\n" and the like); keep
+            # exact str.splitlines semantics, which normalize them to "\n"
+            return "\n".join(
+                line for line in output.splitlines() if not pattern.search(line)
+            )
+
+        pieces = []
+        pos = 0
+        # Drop each whole marker line, newline included; the "=== ... ==="
+        # echo lines contain the bare markers
+        for match in pattern.finditer(output):
+            line_start = output.rfind("\n", 0, match.start()) + 1
+            if line_start < pos:
+                continue  # Second marker on a line already dropped
+            line_end = output.find("\n", match.end())
+            pieces.append(output[pos:line_start])
+            pos = len(output) if line_end < 0 else line_end + 1
+        pieces.append(output[pos:])
+        # Cleaned output carries no trailing newline, as from splitlines/join
+        return "".join(pieces).removesuffix("\n")
 
 
 class CommandValidator:
@@ -293,9 +303,24 @@ class CommandValidator:
             command_hash = context.get('_echo_marker_hash')
 
             if execution_id:
-                # Verify markers are present
-                has_start = f"CMD_MARKER_START_{execution_id}" in result.stdout
-                has_end = f"CMD_MARKER_END_{execution_id}" in result.stdout
+                start_marker = (
+                    context.get('_echo_marker_start_str')
+                    or f"CMD_MARKER_START_{execution_id}"
+                )
+                end_marker = (
+                    context.get('_echo_marker_end_str')
+                    or f"CMD_MARKER_END_{execution_id}"
+                )
+
+                # Verify markers are present; the end marker only counts
+                # after the start marker, so the search resumes from there
+                stdout = result.stdout
+                start = stdout.find(start_marker)
+                has_start = start >= 0
+                if has_start:
+                    has_end = stdout.find(end_marker, start + len(start_marker)) >= 0
+                else:
+                    has_end = end_marker in stdout
 
                 # Log execution
                 self._execution_log.append({
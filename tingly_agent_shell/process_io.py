@@ -0,0 +1,146 @@
+"""
+Helpers shared by the shell implementations for driving bash processes:
+building environment preludes, reading framed output and killing process
+groups.
+"""
+
+import asyncio
+import os
+import re
+import shlex
+import signal
+from typing import Mapping, Optional
+
+# Environment names bash can export or unset
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+
+
+def env_prelude(base: Mapping[str, str], env: Mapping[str, str]) -> str:
+    """
+    Build the commands turning a shell's environment ``base`` into ``env``.
+
+    Args:
+        base: Environment the shell was started with
+        env: Environment the command should see
+
+    Returns:
+        Shell snippet of unset/export statements
+    """
+    parts = [
+        f"unset {key}"
+        for key in base
+        if key not in env and IDENTIFIER.match(key)
+    ]
+    parts.extend(
+        f"export {key}={shlex.quote(value)}"
+        for key, value in env.items()
+        if base.get(key) != value and IDENTIFIER.match(key)
+    )
+    return "\n".join(parts)
+
+
+def tail(data: bytes, limit: Optional[int]) -> bytes:
+    """
+    Keep the last ``limit`` bytes of command output.
+
+    Args:
+        data: Command output
+        limit: Bytes to keep (None keeps everything)
+
+    Returns:
+        The output, truncated from the front if needed
+    """
+    if limit is None or len(data) <= limit:
+        return data
+    return data[len(data) - limit :]
+
+
+async def read_capped(stream: asyncio.StreamReader, limit: Optional[int]) -> bytes:
+    """
+    Read a stream to EOF, keeping at most its last ``limit`` bytes.
+
+    Args:
+        stream: Stream to read
+        limit: Bytes to keep (None keeps everything)
+
+    Returns:
+        The stream's output, truncated from the front if needed
+    """
+    if limit is None:
+        return await stream.read()
+
+    buf = bytearray()
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return tail(bytes(buf), limit)
+        buf += chunk
+        if len(buf) > 2 * limit + 65536:
+            # Trim rarely, so dropping old output stays amortized O(n)
+            del buf[: len(buf) - limit]
+
+
+async def killpg(process: asyncio.subprocess.Process) -> None:
+    """
+    Kill a process started in its own session, with everything it started.
+
+    Args:
+        process: Process to kill
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    await process.wait()
+
+
+async def read_until(
+    reader: asyncio.StreamReader,
+    marker: bytes,
+    terminator: bytes = b"",
+    limit: Optional[int] = None,
+    buf: Optional[bytearray] = None,
+) -> bytes:
+    """
+    Read from a stream until the marker (and a following terminator) arrives.
+
+    Args:
+        reader: Stream to read
+        marker: Marker ending the command's output
+        terminator: Bytes that must follow the marker, if any
+        limit: Output bytes worth keeping; older output may be dropped
+            while reading (None keeps everything)
+        buf: Buffer to read into, which keeps the output read so far if
+            the read is cancelled (e.g. on a timeout)
+
+    Returns:
+        Everything read, up to and excluding the terminator; if the stream
+        ends first, everything read without the marker
+    """
+    if buf is None:
+        buf = bytearray()
+    # Room for the marker line on top of the kept output
+    keep = None if limit is None else limit + len(marker) + 32
+    found = -1
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            return bytes(buf)
+        # Only the new chunk, plus a marker's length of overlap for a marker
+        # straddling the boundary, needs searching
+        search_start = max(0, len(buf) - len(marker) + 1)
+        buf += chunk
+        if found < 0 and keep is not None and len(buf) > 2 * keep + 65536:
+            # Trim rarely, so dropping old output stays amortized O(n)
+            trimmed = len(buf) - keep
+            del buf[:trimmed]
+            search_start = max(0, search_start - trimmed)
+        if found < 0:
+            found = buf.find(marker, search_start)
+            if found < 0:
+                continue
+        if not terminator:
+            return bytes(buf)
+        end = buf.find(terminator, found + len(marker))
+        if end >= 0:
+            return bytes(buf[:end])
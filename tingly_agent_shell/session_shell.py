@@ -3,11 +3,18 @@ SessionShell implementation - maintains an interactive session.
 """
 
 import asyncio
+import os
+import signal
 import time
+import uuid
 from typing import Any, Optional, TYPE_CHECKING
 
+from .base import _close_stdin, _reap, _wait_pid
+from .process_io import read_until
+from .types import ExecuteResult
+
 if TYPE_CHECKING:
-    from .types import ShellConfig, ExecuteResult
+    from .types import ShellConfig
     from .base import AgentShell
 
 
@@ -36,12 +43,19 @@ class SessionShell:
 
         # Store the base shell implementation
         self._shell = AgentShell(config=config, parent=parent._shell if parent else None)
+        # Bind frequently used attributes so they skip __getattr__ delegation
+        self.config = self._shell.config
+        self._env = self._shell._env
+        self._lock = self._shell._lock
         # Ensure persistent mode for sessions
-        if not self._shell.config.persistent:
-            self._shell.config.persistent = True
+        if not self.config.persistent:
+            self.config.persistent = True
 
         self._persistent_process: Optional[asyncio.subprocess.Process] = None
-        self._output_reader_task: Optional[asyncio.Task] = None
+        # Unique per-shell marker prefix; a sequence number per command is
+        # appended so output of a timed-out command can't end a later read
+        self._marker = f"__TINGLY_{uuid.uuid4().hex}_".encode()
+        self._marker_seq = 0
 
     def __getattr__(self, name: str) -> Any:
         """Delegate all other attributes to the base shell."""
@@ -67,8 +81,8 @@ class SessionShell:
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 stdin=asyncio.subprocess.PIPE,
-                env=self._shell._env,
-                cwd=self._shell.config.workdir,
+                env=self._env,
+                cwd=self.config.workdir,
             )
 
         except Exception as e:
@@ -81,29 +95,18 @@ class SessionShell:
         Returns:
             Command string to initialize the shell
         """
-        parts = []
-
-        # Set environment variables
-        for key, value in self._shell._env.items():
-            # Escape special characters in the value
-            escaped_value = value.replace('"', '\\"').replace('$', '\\$')
-            parts.append(f'export {key}="{escaped_value}"')
-
-        # Run pre_scripts
-        for script in self._shell.config.pre_scripts:
-            parts.append(script)
-
-        # Start interactive shell to keep process alive
-        parts.append(self._shell.config.shell_type)
-
-        return "; ".join(parts)
+        config = self.config
+        # The environment is not exported here: the process is started with
+        # it already, and replaying it as export lines only slows startup.
+        # Run pre_scripts, then start interactive shell to keep process alive
+        return "\n".join((*config.pre_scripts, config.shell_type))
 
     async def execute(
         self,
         command: str,
         timeout: Optional[float] = None,
         check: bool = False,
-        sync_env: bool = True,
+        sync_env: Optional[bool] = None,
     ) -> "ExecuteResult":
         """
         Execute a command on the persistent session.
@@ -112,7 +115,8 @@ class SessionShell:
             command: Command to execute
             timeout: Timeout in seconds
             check: If True, raise exception on non-zero exit code
-            sync_env: If True, sync environment variables after execution
+            sync_env: If True, sync environment variables after execution.
+                None (default) syncs only for env-mutating commands
 
         Returns:
             ExecuteResult with command output and metadata
@@ -121,27 +125,31 @@ class SessionShell:
         if self._persistent_process is None:
             await self._start_persistent_process()
             # Run pre_scripts on the persistent process
-            for script in self._shell.config.pre_scripts:
+            for script in self.config.pre_scripts:
                 await self._execute_on_persistent_process(script)
 
-        # Apply hooks
-        execution_context = {
-            'timeout': timeout,
-            'sync_env': sync_env,
-            'timestamp': time.time(),
-        }
-        wrapped_command = await self._shell._apply_hooks(command, context=execution_context)
+        sync_env = self._shell._should_sync_env(command, sync_env)
+
+        # Apply hooks; without any, skip building the context and both passes
+        hooks = self._shell._hooks
+        wrapped_command = command
+        if hooks:
+            execution_context = {
+                'timeout': timeout,
+                'sync_env': sync_env,
+                'timestamp': time.time(),
+            }
+            wrapped_command = await self._shell._apply_hooks(command, context=execution_context)
 
         # Execute on persistent process
         result = await self._execute_on_persistent_process(wrapped_command, timeout)
 
         # Parse and update environment
-        if sync_env:
-            exported_vars = self._shell._parse_export_command(command)
-            self._shell._env.update(exported_vars)
+        self._shell._track_state_changes(command, result.returncode, sync_env)
 
         # Apply post-execute hooks
-        result = await self._shell._apply_hooks(command, result, execution_context)
+        if hooks:
+            result = await self._shell._apply_hooks(command, result, execution_context)
 
         return result
 
@@ -160,75 +168,109 @@ class SessionShell:
         Returns:
             ExecuteResult with command output and metadata
         """
-        async with self._shell._lock:  # Ensure only one command executes at a time
+        async with self._lock:  # Ensure only one command executes at a time
             if self._persistent_process is None:
                 raise RuntimeError("Persistent process not started")
 
             try:
-                # Send command to the persistent process
-                command_with_newline = f"{command}\n"
-                self._persistent_process.stdin.write(command_with_newline.encode())
+                # Send the command followed by a marker line carrying its exit
+                # code, so the end of its output can be found without guessing;
+                # stderr gets a marker line too, so it need not be polled
+                self._marker_seq += 1
+                marker = self._marker + b"%d:" % self._marker_seq
+                framed = (
+                    f"{command}\nprintf '%s%d\\n' '{marker.decode()}' \"$?\"; "
+                    f"printf '%s\\n' '{marker.decode()}' >&2\n"
+                )
+                self._persistent_process.stdin.write(framed.encode())
                 await self._persistent_process.stdin.drain()
 
-                # Read output until we see a prompt or timeout
-                stdout_lines = []
-                stderr_lines = []
-                prompt_seen = False
+                buf = bytearray()
+                err_buf = bytearray()
+                # -1 until the marker arrives (timeout or shell exited)
+                returncode = -1
 
                 start_time = time.time()
 
-                # Read stdout
-                while not prompt_seen:
-                    try:
-                        line = await asyncio.wait_for(
-                            self._persistent_process.stdout.readline(),
-                            timeout=timeout or 30.0,
-                        )
-                        if not line:
-                            break
-                        line_str = line.decode("utf-8", errors="replace")
-                        stdout_lines.append(line_str)
-                        # Check if this looks like a prompt
-                        if line_str.strip().endswith("$ ") or "$ " in line_str:
-                            prompt_seen = True
-                    except asyncio.TimeoutError:
-                        # Timeout reading - might be a long-running command
-                        # Return what we have so far
-                        break
-
-                # Read any remaining stderr
+                # Read both streams until their marker lines
                 try:
-                    while True:
-                        line = await asyncio.wait_for(
-                            self._persistent_process.stderr.readline(),
-                            timeout=0.1,
-                        )
-                        if not line:
-                            break
-                        stderr_lines.append(line.decode("utf-8", errors="replace"))
+                    stdout, stderr = await asyncio.wait_for(
+                        asyncio.gather(
+                            read_until(self._persistent_process.stdout, marker, b"\n", buf=buf),
+                            read_until(self._persistent_process.stderr, marker, b"\n", buf=err_buf),
+                        ),
+                        timeout=timeout or 30.0,
+                    )
                 except asyncio.TimeoutError:
-                    pass
-
-                stdout = "".join(stdout_lines)
-                stderr = "".join(stderr_lines)
+                    # Timeout reading - might be a long-running command
+                    # Return what we have so far
+                    stdout, stderr = bytes(buf), bytes(err_buf)
+                else:
+                    # Without a marker the shell exited before finishing
+                    output, found, status = stdout.rpartition(marker)
+                    if found:
+                        returncode = int(status)
+                        stdout = self._command_output(output)
+                    err_output, err_found, _ = stderr.rpartition(marker)
+                    if err_found:
+                        stderr = self._command_output(err_output)
 
                 execution_time = time.time() - start_time
 
-                # For persistent mode, we assume success if no exception
-                # A more robust implementation would capture actual return codes
-                returncode = 0
-
                 return ExecuteResult(
                     command=command,
                     returncode=returncode,
-                    stdout=stdout,
-                    stderr=stderr,
+                    stdout_bytes=stdout,
+                    stderr_bytes=stderr,
                     execution_time=execution_time,
                 )
 
             except Exception as e:
                 raise RuntimeError(f"Failed to execute command on persistent process: {e}") from e
 
+    def _command_output(self, output: bytes) -> bytes:
+        """
+        Drop output left over from an earlier timed-out command.
+
+        Args:
+            output: Output read from stdout or stderr, up to this command's
+                marker
+
+        Returns:
+            The command's own output
+        """
+        stale = output.rfind(self._marker)
+        if stale < 0:
+            return output
+        return output[output.find(b"\n", stale) + 1 :]
+
+    def close(self) -> None:
+        """
+        Close the shell without waiting for the session process to exit.
+
+        The process is terminated and reaped in the background; await
+        drain_reapers() to wait for it.
+        """
+        self._shell._closed = True
+
+        if self._persistent_process is not None:
+            process, self._persistent_process = self._persistent_process, None
+            # EOF ends the session shell even if it outlives the wrapper
+            # process that terminate() signals
+            if _close_stdin(process):
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    pass
+                _reap(process)
+            else:
+                # The loop is closed, so nothing would reap it later
+                try:
+                    os.kill(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                _wait_pid(process.pid)
+
     async def async_close(self) -> None:
         """
         Asynchronously close the shell and clean up resources.
@@ -2,13 +2,46 @@
 StateShell implementation - tracks environment state and working directory.
 """
 
-import re
-from typing import Any, Optional, TYPE_CHECKING
+from typing import Any, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .types import ShellConfig, ExecuteResult, ShellState
     from .base import AgentShell
 
+_PWD_START = "=== STATE_PWD_START ==="
+_PWD_END = "=== STATE_PWD_END ==="
+_ENV_START = "=== STATE_ENV_START ==="
+_ENV_END = "=== STATE_ENV_END ==="
+
+
+def _extract_block(
+    output: str,
+    start_tag: str,
+    end_tag: str,
+    pos: int = 0,
+) -> Tuple[Optional[str], int]:
+    """
+    Extract the text between two literal state markers.
+
+    Args:
+        output: Command output containing the markers
+        start_tag: Marker opening the block
+        end_tag: Marker closing the block
+        pos: Offset to start searching from
+
+    Returns:
+        Stripped text between the markers (None if either is missing) and
+        the offset to continue searching from
+    """
+    start = output.find(start_tag, pos)
+    if start < 0:
+        return None, pos
+    start += len(start_tag)
+    end = output.find(end_tag, start)
+    if end < 0:
+        return None, pos
+    return output[start:end].strip(), end + len(end_tag)
+
 
 class StateShell:
     """
@@ -35,7 +68,14 @@ class StateShell:
 
         # Store the base shell implementation
         self._shell = AgentShell(config=config, parent=parent._shell if parent else None)
+        # Bind frequently used attributes so they skip __getattr__ delegation
+        self.config = self._shell.config
+        self._env = self._shell._env
+        self._lock = self._shell._lock
         self._last_pwd: Optional[str] = None
+        # Last export -p dump parsed and the env version right after, to skip
+        # reparsing an unchanged dump while nothing else has written the env
+        self._last_env_block: Optional[Tuple[str, int]] = None
         self._state_sync_enabled = True
 
     def __getattr__(self, name: str) -> Any:
@@ -47,7 +87,7 @@ class StateShell:
         command: str,
         timeout: Optional[float] = None,
         check: bool = False,
-        sync_env: bool = True,
+        sync_env: Optional[bool] = None,
     ) -> "ExecuteResult":
         """
         Execute a command with automatic state tracking.
@@ -56,11 +96,15 @@ class StateShell:
             command: Command to execute
             timeout: Timeout in seconds
             check: If True, raise exception on non-zero exit code
-            sync_env: If True, sync environment variables after execution
+            sync_env: If True, sync environment variables after execution.
+                None (default) syncs only for env-mutating commands
 
         Returns:
             ExecuteResult with command output and metadata
         """
+        # Decide on the user's command; the injected tracking always exports
+        sync_env = self._shell._should_sync_env(command, sync_env)
+
         # Inject state tracking commands
         command_to_execute = self._inject_state_tracking(command)
 
@@ -90,14 +134,15 @@ class StateShell:
         """
         # State tracking commands to run AFTER the user command
         post_tracking = (
-            "echo '=== STATE_PWD_START ==='; pwd; echo '=== STATE_PWD_END ==='; "
-            "echo '=== STATE_ENV_START ==='; export -p; echo '=== STATE_ENV_END ==='"
+            f"echo '{_PWD_START}'; pwd; echo '{_PWD_END}'; "
+            f"echo '{_ENV_START}'; export -p; echo '{_ENV_END}'"
         )
 
         # Execute the command first, then capture state afterwards
         # Run command directly (not in subshell) so cd/export take effect
-        # Save exit code to preserve it after state tracking
-        wrapped = f"{command}; __exit_code__=$?; {post_tracking}; exit $__exit_code__"
+        # Save exit code to preserve it after state tracking; the subshell
+        # sets $? without exiting a persistent shell
+        wrapped = f"{command}; __exit_code__=$?; {post_tracking}; (exit $__exit_code__)"
 
         return wrapped
 
@@ -112,23 +157,17 @@ class StateShell:
         output = stdout
 
         # Extract PWD
-        pwd_match = re.search(
-            r"=== STATE_PWD_START ===\s*(.+?)\s*=== STATE_PWD_END ===",
-            output,
-            re.MULTILINE | re.DOTALL,
-        )
-        if pwd_match:
-            self._last_pwd = pwd_match.group(1).strip()
-
-        # Extract environment
-        env_match = re.search(
-            r"=== STATE_ENV_START ===\s*(.+?)\s*=== STATE_ENV_END ===",
-            output,
-            re.MULTILINE | re.DOTALL,
-        )
-        if env_match:
-            env_output = env_match.group(1)
+        pwd, pos = _extract_block(output, _PWD_START, _PWD_END)
+        if pwd:
+            self._last_pwd = pwd
+
+        # Extract environment; it is printed after the PWD block, so the
+        # search carries on from there instead of rescanning the output
+        env_output, _ = _extract_block(output, _ENV_START, _ENV_END, pos)
+        env = self._shell._env
+        if env_output and (env_output, env.version) != self._last_env_block:
             self._shell._parse_and_update_env(env_output)
+            self._last_env_block = (env_output, env.version)
 
     def get_pwd(self) -> Optional[str]:
         """
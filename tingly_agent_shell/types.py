@@ -3,13 +3,13 @@ Data types and configuration classes.
 """
 
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any, TYPE_CHECKING
+from typing import Dict, List, Optional, Tuple, Any, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from tingly_agent_shell.hooks import CommandHook
 
 
-@dataclass
+@dataclass(slots=True)
 class ShellConfig:
     """Configuration for shell initialization."""
 
@@ -20,9 +20,21 @@ class ShellConfig:
     persistent: bool = True  # Enable persistent shell session by default
     # Command hooks to process commands before/after execution
     hooks: List["CommandHook"] = field(default_factory=list)
+    # Launch one-off commands through posix_spawn instead of fork+exec
+    use_posix_spawn: bool = True
+    # Fork one-off commands from a shared bash daemon instead of this process;
+    # takes precedence over persistent
+    multiplex: bool = False
+    # Run one-off commands in pre-started shells from a shared pool;
+    # takes precedence over persistent
+    pooled: bool = False
+    # Create one-off processes in a worker thread, off the event loop
+    spawn_in_executor: bool = False
+    # Keep only the last N bytes of each output stream (None keeps all)
+    max_output_bytes: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ShellState:
     """Represents the current shell state including working directory and environment."""
 
@@ -30,12 +42,95 @@ class ShellState:
     env: Dict[str, str] = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(init=False)
 class ExecuteResult:
-    """Result of a command execution."""
+    """
+    Result of a command execution.
+
+    Output is stored as raw bytes and decoded on first access. Results can be
+    built from decoded text, ``ExecuteResult(command, returncode, stdout,
+    stderr, execution_time)``, or from raw output with the ``stdout_bytes``
+    and ``stderr_bytes`` keywords, but not both for one stream. To change
+    output with ``dataclasses.replace``, pass ``stdout_bytes``/``stderr_bytes``;
+    the text keywords would clash with the copied raw output.
+    """
+
+    # Decoded output is cached in _stdout/_stderr, which are not fields
+    __slots__ = (
+        "command",
+        "returncode",
+        "stdout_bytes",
+        "stderr_bytes",
+        "execution_time",
+        "_stdout",
+        "_stderr",
+    )
 
     command: str
     returncode: int
-    stdout: str
-    stderr: str
+    stdout_bytes: bytes
+    stderr_bytes: bytes
     execution_time: float
+
+    def __init__(
+        self,
+        command: str,
+        returncode: int,
+        stdout: Optional[str] = None,
+        stderr: Optional[str] = None,
+        execution_time: float = 0.0,
+        *,
+        stdout_bytes: Optional[bytes] = None,
+        stderr_bytes: Optional[bytes] = None,
+    ):
+        """
+        Initialize an ExecuteResult.
+
+        Args:
+            command: Executed command
+            returncode: Exit code
+            stdout: Decoded stdout, if stdout_bytes is not given
+            stderr: Decoded stderr, if stderr_bytes is not given
+            execution_time: Execution time in seconds
+            stdout_bytes: Raw stdout, decoded on first access
+            stderr_bytes: Raw stderr, decoded on first access
+
+        Raises:
+            TypeError: If a stream is given both as text and as bytes
+        """
+        self.command = command
+        self.returncode = returncode
+        self.execution_time = execution_time
+        self.stdout_bytes, self._stdout = _raw_and_text("stdout", stdout_bytes, stdout)
+        self.stderr_bytes, self._stderr = _raw_and_text("stderr", stderr_bytes, stderr)
+
+    @property
+    def stdout(self) -> str:
+        """Command stdout, decoded on first access."""
+        if self._stdout is None:
+            self._stdout = _decode(self.stdout_bytes)
+        return self._stdout
+
+    @property
+    def stderr(self) -> str:
+        """Command stderr, decoded on first access."""
+        if self._stderr is None:
+            self._stderr = _decode(self.stderr_bytes)
+        return self._stderr
+
+
+def _raw_and_text(
+    name: str, raw: Optional[bytes], text: Optional[str]
+) -> Tuple[bytes, Optional[str]]:
+    """Pair raw output with its text, if known; text alone is encoded."""
+    if raw is not None:
+        if text is not None:
+            raise TypeError(f"pass either {name} or {name}_bytes, not both")
+        return raw, None
+    text = text or ""
+    return text.encode("utf-8", errors="surrogatepass"), text
+
+
+def _decode(raw: bytes) -> str:
+    """Decode command output; ASCII (the common case) takes the fastest codec."""
+    return raw.decode("ascii" if raw.isascii() else "utf-8", errors="replace")